@@ -18,7 +18,12 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 from sklearn.metrics import cohen_kappa_score
 from scipy.spatial.distance import cosine, euclidean
 from collections import defaultdict
+from multiprocessing import Pool
+import matplotlib
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from os.path import join, dirname, basename
 import numpy as np
 
@@ -247,50 +252,56 @@ def agreement_iou(lis_1, lis_2):
     return list_iou
 
 
-def stats_iou(lis_1, lis_2, output=None, classes='classes.cfg'):
+def save_histogram(plot):
+    """ Save the histogram of IoU scores with counts already computed.
+        It does not use the global state of pyplot in order to be
+        executed by a pool of workers.
+    """
+    counts, edges, title, fileout = plot
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+    ax.set_xlim(0, 1.0)
+    ax.set_title(title)
+    ax.set_xlabel('IoU scores')
+    ax.set_ylabel('Number of instances')
+    fig.savefig(fileout)
+    return fileout
+
+
+def stats_iou(lis_1, lis_2, output=None, classes='classes.cfg', nb_workers=None):
     """ Check statistics for IoU objects. """
     if not output:
         output = dirname(lis_1)
 
     dclasses = fh.ConfigFile(classes).load_classes()
 
-    accumulated_iou = 0.0
-    nb_objects = 0
-    dic_obj = defaultdict(list)
-    all_iou = []
-
-    # create dictionary with iou for each object
-    list_iou = agreement_iou(lis_1, lis_2)
-    for _, idobj, iou in list_iou:
-        dic_obj[idobj].append(iou)
-        accumulated_iou += iou
-        all_iou.append(iou)
-        nb_objects += 1
-
-    # convert to numpy arrays
-    for idobj in dic_obj:
-        dic_obj[idobj] = np.array(dic_obj[idobj])
-    all_iou = np.array(all_iou)
-    
-    # plot distribution for all iou
-    plt.hist(all_iou, bins=100)
-    plt.axis(xmin=0, xmax=1.0)
-    plt.title('Distribution of IoU for all objects')
-    plt.xlabel('IoU scores')
-    plt.ylabel('Number of instances')
-    plt.savefig(join(output, 'iou_all.svg'))
-    plt.clf()
-
-    # plot distribution for each object
-    for idobj in dic_obj:
-        iou_obj = dic_obj[idobj]
-        plt.hist(iou_obj, bins=100)
-        plt.axis(xmin=0, xmax=1.0)
-        plt.title('Distribution of IoU for {}'.format(dclasses[idobj]))
-        plt.xlabel('IoU scores')
-        plt.ylabel('Number of instances')
-        plt.savefig(join(output, 'iou_'+dclasses[idobj]+'.svg'))
-        plt.clf()
+    # create arrays with iou grouped by object
+    list_iou = np.array(agreement_iou(lis_1, lis_2), dtype=np.float64).reshape(-1, 3)
+    ids = list_iou[:, 1].astype(np.int64)
+    all_iou = list_iou[:, 2]
+    order = np.argsort(ids, kind='mergesort')
+    idobjs, starts = np.unique(ids[order], return_index=True)
+    dic_obj = dict(zip(idobjs, np.split(all_iou[order], starts[1:])))
+
+    # histograms for all objects and for each object in a single pass
+    nb_bins = 100
+    edges = np.linspace(0, 1.0, nb_bins+1)
+    bins = np.clip(np.searchsorted(edges, all_iou, side='right')-1, 0, nb_bins-1)
+    positions = np.searchsorted(idobjs, ids)
+    counts = np.bincount(positions*nb_bins+bins, minlength=len(idobjs)*nb_bins)
+    counts = counts.reshape(len(idobjs), nb_bins)
+
+    # plot distributions in a pool of workers
+    plots = [(counts.sum(axis=0), edges, 'Distribution of IoU for all objects', join(output, 'iou_all.svg'))]
+    for i, idobj in enumerate(idobjs):
+        plots.append((counts[i], edges, 'Distribution of IoU for {}'.format(dclasses[idobj]),
+                      join(output, 'iou_'+dclasses[idobj]+'.svg')))
+    pool = Pool(nb_workers)
+    pool.map(save_histogram, plots)
+    pool.close()
+    pool.join()
 
     # save stats of IoU in a file
     with open(join(output,'stats_iou.txt'), 'w') as fout:
@@ -302,7 +313,7 @@ def stats_iou(lis_1, lis_2, output=None, classes='classes.cfg'):
         fout.write('Statistics for Objects\n')
         fout.write('----------------------\n')
         fout.write('Total number of object: {}\n'.format(len(all_iou)))
-        for idobj in dic_obj:
+        for idobj in idobjs:
             fout.write('Object {}: {}\n'.format(dclasses[idobj], len(dic_obj[idobj])))
         fout.write('\n')
         
@@ -321,7 +332,7 @@ def stats_iou(lis_1, lis_2, output=None, classes='classes.cfg'):
 
         fout.write('Intersection over Union (IoU) for objects\n')
         fout.write('-----------------------------------------\n')
-        for idobj in dic_obj:
+        for idobj in idobjs:
             obj_iou = dic_obj[idobj]
             agree_05 = obj_iou[obj_iou>=0.5]
             agree_07 = obj_iou[obj_iou>=0.7]
@@ -363,6 +374,171 @@ def cohen_kappa_relations(fanno_1, fanno_2):
     print('Finished')
 
 
+def aligned_objects(lis_1, lis_2):
+    """ Yield the aligned ids of objects of both annotators for each frame
+
+        Output: (id_frame, objects_1, objects_2)
+    """
+    with fh.LisFile(lis_1) as flis1, \
+         fh.LisFile(lis_2) as flis2:
+        if flis1.nb_frames() != flis2.nb_frames():
+            logger.error('Files do not contain the same number of frames.')
+            sys.exit()
+        for frame_objs1, frame_objs2 in zip(flis1.objects_in_frame(ids=True), flis2.objects_in_frame(ids=True)):
+            idfr, objs1 = frame_objs1
+            idfr, objs2 = frame_objs2
+            objs1, objs2 = align_lists(objs1, objs2)
+            yield idfr, objs1, objs2
+
+
+def aligned_relations(fanno_1, fanno_2):
+    """ Yield the aligned relations of both annotators for each frame
+
+        Output: (id_frame, relations_1, relations_2)
+    """
+    fd1 = fh.DecompressedFile(fanno_1)
+    fd2 = fh.DecompressedFile(fanno_2)
+    for arr1, arr2 in zip(fd1.iterate_frames(), fd2.iterate_frames()):
+        idf1, vec1 = arr1
+        idf2, vec2 = arr2
+        if idf1 != idf2:
+            logger.error('Files do not contain the same sequence of frames: {}/{}'.format(idf1, idf2))
+            sys.exit()
+        v1, v2 = align_lists(vec1, vec2)
+        yield idf1, v1, v2
+
+
+def sliding_kappa(aligned_frames, window, step=1):
+    """ Compute the Cohen's Kappa agreement for a sliding window of frames.
+        Instead of recomputing the agreement for each window, the marginals
+        and the diagonal of the confusion matrix are accumulated along the
+        frames, so that the counts of a window are the difference between
+        the accumulated counts at its end and at its start.
+
+        Parameters:
+        -----------
+        aligned_frames: iterable
+            sequence of (id_frame, labels_1, labels_2) containing aligned
+            labels of both annotators (see `aligned_objects`)
+        window: int
+            number of frames in each window
+        step: int
+            number of frames between the start of two windows
+
+        Output: (id_frames, kappa) where `id_frames` contains the first
+            frame of each window. Windows where both annotators agree on a
+            single label have kappa equals 1 and windows without labels have
+            kappa equals NaN. Both arrays are empty when there are no frames.
+    """
+    dlabels = {}
+    idframes, frames, labels_1, labels_2 = [], [], [], []
+    for i, (idfr, vec1, vec2) in enumerate(aligned_frames):
+        idframes.append(idfr)
+        for l1, l2 in zip(vec1, vec2):
+            frames.append(i)
+            labels_1.append(dlabels.setdefault(l1, len(dlabels)))
+            labels_2.append(dlabels.setdefault(l2, len(dlabels)))
+    nb_frames = len(idframes)
+    if not nb_frames:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    frames = np.array(frames, dtype=np.int64)+1
+    labels_1 = np.array(labels_1, dtype=np.int64)
+    labels_2 = np.array(labels_2, dtype=np.int64)
+
+    # accumulated counts with a row of zeros before the first frame
+    shape = (nb_frames+1, len(dlabels))
+    rows = np.zeros(shape, dtype=np.int32)
+    cols = np.zeros(shape, dtype=np.int32)
+    np.add.at(rows, (frames, labels_1), 1)
+    np.add.at(cols, (frames, labels_2), 1)
+    rows = np.cumsum(rows, axis=0, out=rows)
+    cols = np.cumsum(cols, axis=0, out=cols)
+    total = np.cumsum(np.bincount(frames, minlength=nb_frames+1))
+    diag = np.cumsum(np.bincount(frames[labels_1 == labels_2], minlength=nb_frames+1))
+
+    window = min(window, nb_frames)
+    starts = np.arange(0, nb_frames-window+1, step)
+    ends = starts+window
+    nb_labels = (total[ends]-total[starts]).astype(np.float64)
+    expected = ((rows[ends]-rows[starts]).astype(np.float64) * (cols[ends]-cols[starts])).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        po = (diag[ends]-diag[starts]) / nb_labels
+        pe = expected / nb_labels**2
+        kappa = np.where(pe < 1, (po-pe)/(1-pe), 1.0)
+    kappa[nb_labels == 0] = np.nan
+    return np.array(idframes)[starts], kappa
+
+
+def sliding_iou(list_iou, window, step=1):
+    """ Compute the mean IoU for a sliding window of frames from the output
+        of `agreement_iou`. Frames without pairs of bounding boxes do not
+        contribute to the mean of the window.
+
+        Output: (id_frames, iou) where `id_frames` contains the first frame
+            of each window. Windows without pairs have IoU equals NaN and
+            both arrays are empty when `list_iou` is empty.
+    """
+    arr = np.array(list_iou, dtype=np.float64).reshape(-1, 3)
+    if not len(arr):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    frames = arr[:, 0].astype(np.int64)
+    first = frames.min()
+    nb_frames = frames.max()-first+1
+    frames = frames-first+1
+    sums = np.cumsum(np.bincount(frames, weights=arr[:, 2], minlength=nb_frames+1))
+    counts = np.cumsum(np.bincount(frames, minlength=nb_frames+1))
+
+    window = min(window, nb_frames)
+    starts = np.arange(0, nb_frames-window+1, step)
+    ends = starts+window
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = (sums[ends]-sums[starts]) / (counts[ends]-counts[starts])
+    return starts+first, iou
+
+
+def windowed_agreement(file_1, file_2, window, step=1, lis=False, output=None, plot=False):
+    """ Compute the agreement between annotators for a sliding window of
+        frames and save the time series in a `.npz` file. When `lis=True`,
+        input files contain LIS annotation of objects and the IoU is also
+        computed. Otherwise, input files contain Decompressed relations.
+    """
+    if not output:
+        output = dirname(file_1)
+    fname = fh.filename(file_1, extension=False)
+
+    if lis:
+        frames, kappa = sliding_kappa(aligned_objects(file_1, file_2), window, step)
+    else:
+        frames, kappa = sliding_kappa(aligned_relations(file_1, file_2), window, step)
+    series = {'kappa_frames': frames, 'kappa': kappa}
+    if lis:
+        series['iou_frames'], series['iou'] = sliding_iou(agreement_iou(file_1, file_2), window, step)
+
+    fileout = join(output, fname+'_windowed.npz')
+    np.savez(fileout, window=window, step=step, **series)
+    logger.info('Saved windowed agreement at: {}'.format(fileout))
+    if not len(kappa):
+        logger.warning('Input files do not contain frames')
+        return
+
+    # show the windows that need re-annotation
+    for i in np.argsort(kappa, kind='stable')[:5]:
+        logger.info('Low agreement at frames {}-{}: kappa={:.3f}'.format(frames[i], frames[i]+window-1, kappa[i]))
+
+    if plot:
+        plt.figure(figsize=(15,5))
+        plt.plot(frames, kappa, label='Kappa')
+        if lis:
+            plt.plot(series['iou_frames'], series['iou'], label='IoU')
+            plt.legend()
+        plt.axis(ymin=min(0, np.nanmin(kappa)), ymax=1.0)
+        plt.title('Agreement for windows of {} frames'.format(window))
+        plt.xlabel('Initial frame of the window')
+        plt.ylabel('Agreement')
+        plt.savefig(join(output, fname+'_windowed.svg'))
+        plt.clf()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('annotator_1', metavar='lis_annotator_1', help='LIS annotation file 1.')
@@ -370,9 +546,18 @@ if __name__ == '__main__':
     parser.add_argument('-c', '--cohen', help='Choose Cohen Kappa agreement', default=None)
     parser.add_argument('-s', '--stats', help='Check stats of the agreement', default=None)
     parser.add_argument('-i', '--iou', help='Agreement using IoU agreement', default=None)
+    parser.add_argument('-w', '--window', help='Compute the agreement for sliding windows with this number of frames', type=int, default=None)
+    parser.add_argument('-t', '--step', help='Number of frames between sliding windows', type=int, default=1)
+    parser.add_argument('-l', '--lis', help='Input files contain LIS annotation instead of relations', action='store_true')
+    parser.add_argument('-o', '--output', help='Folder to save the windowed agreement', default=None)
+    parser.add_argument('-p', '--plot', help='Save a plot of the windowed agreement', action='store_true')
     args = parser.parse_args()
-    
+
     #cohens_kappa(args.annotator_1, args.annotator_2)
     #stats_of_agreement(args.annotator_1, args.annotator_2)
     #stats_iou(args.annotator_1, args.annotator_2)
-    cohen_kappa_relations(args.annotator_1, args.annotator_2)
+    if args.window:
+        windowed_agreement(args.annotator_1, args.annotator_2, args.window, step=args.step,
+                           lis=args.lis, output=args.output, plot=args.plot)
+    else:
+        cohen_kappa_relations(args.annotator_1, args.annotator_2)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script reads a folder and compress all files inside the folder.
+Dictionaries of objects and relations are loaded once and files are
+compressed by a pool of workers. Each output file is written with a
+temporary name and renamed when it is complete.
+
+"""
+import sys
+import os
+import argparse
+from os.path import join, basename, realpath
+from multiprocessing import Pool
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import filehandler as fh
+import compress_relations as cr
+
+
+def compress_file(task):
+    """ Compress a single file (executed by workers). Errors (including
+        `sys.exit` of malformed files) are returned instead of raised,
+        thus, a bad file does not stop the pool.
+
+        Output: (file_input, foutput, error) where `error` is None for
+            files that were compressed
+    """
+    file_input, foutput, do, dr, keep_names = task
+    ftmp = foutput+'.part'
+    try:
+        cr.compress_relations(file_input, output=ftmp, keep_names=keep_names, do=do, dr=dr)
+    except (Exception, SystemExit) as err:
+        if os.path.exists(ftmp):
+            os.remove(ftmp)
+        return file_input, foutput, repr(err)
+    os.rename(ftmp, foutput)
+    return file_input, foutput, None
+
+
+def compress_data(folder_input, output=None, class_file='classes.cfg', rels_file='relations.cfg', keep_names=False, nb_workers=None):
+    if not output:
+        output = join(folder_input, 'compressed.tmp')
+        output = fh.mkdir_from_file(output)
+
+    do = fh.ConfigFile(class_file).load_classes(cnames=True)
+    dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+    logger.info('Loaded dictionaries with {} objects and {} relations.'.format(len(do), len(dr)))
+
+    # load files (skipping files from a previous output inside the input folder)
+    decompfiles = fh.FolderHandler(folder_input)
+    tasks = []
+    for file_input in decompfiles:
+        if realpath(file_input).startswith(realpath(output)+os.sep): continue
+        tasks.append((file_input, join(output, basename(file_input)), do, dr, keep_names))
+
+    pool = Pool(nb_workers)
+    errors = []
+    for file_input, foutput, error in pool.imap_unordered(compress_file, tasks):
+        if error:
+            logger.error('Could not compress file: {} ({})'.format(file_input, error))
+            errors.append(file_input)
+        else:
+            logger.info('Compressed file: {}'.format(foutput))
+    pool.close()
+    pool.join()
+    logger.info('Compressed {} files into: {}'.format(len(tasks)-len(errors), output))
+    if errors:
+        logger.error('Failed to compress {} files:'.format(len(errors)))
+        for file_input in sorted(errors):
+            logger.error('- {}'.format(file_input))
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='input_folder', help='Folder containing decompressed relations')
+    parser.add_argument('-o', '--output', help='Output folder', default=None)
+    parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-n', '--store_names', help='Save names for objects and relations instead of their ids.', action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
+    args = parser.parse_args()
+
+    compress_data(args.input, args.output, args.class_file, args.relation_file, args.store_names, args.workers)
@@ -40,37 +40,45 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
 import filehandler as fh
+import relation_arrays as ra
 
 
-def compress_relations(file_input, output=None, class_file='classes.cfg', rels_file='relations.cfg', keep_names=False):
+def compress_relations(file_input, output=None, class_file='classes.cfg', rels_file='relations.cfg', keep_names=False, do=None, dr=None):
     if not output:
         fname, _ = splitext(basename(file_input))
         output = join(dirname(file_input), fname+'_compressed.txt')
 
-    # Load classes for objects from dict {0: 'rel0', 1: 'rel1'}
-    do = fh.ConfigFile(class_file).load_classes(cnames=True)
-    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
-    dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
-    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
-
-    df = fh.DecompressedFile(file_input)
-    dcomp = df.group_relations()
-    logger.info('Found {} relations spread on {} lines of the input file.'.format(len(df.start_frames), df.nb_line-1))
-    logger.info('Compressed to {} lines in output file.'.format(len(df.start_frames)))
+    # Load classes for objects from dict {'rel0': 0, 'rel1': 1}
+    if do is None:
+        do = fh.ConfigFile(class_file).load_classes(cnames=True)
+        logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+    if dr is None:
+        dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+        logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+
+    if keep_names:
+        vocab = ra.Vocabulary()
+    else:
+        vocab = ra.ConfigVocabulary(do=do, dr=dr)
+    rarr = ra.load_decompressed(file_input, vocab)
+    if (rarr.triplets < 0).any():
+        logger.error('Input file contains objects or relations that are not in the dictionaries.')
+        sys.exit()
+    starts, ends, triplets = ra.compress_runs(rarr)
+    logger.info('Found {} relations spread on {} lines of the input file.'.format(len(starts), len(rarr)))
+    logger.info('Compressed to {} lines in output file.'.format(len(starts)))
 
     logger.info('Saving output file...')
     with open(output, 'w') as fout:
         if keep_names:
             fout.write('Initial_frame-Final_frame Subject Relation Object\n')
+            fout.writelines('%d-%d %s %s %s\n' % ((start, end)+vocab.decode(idt))
+                            for start, end, idt in zip(starts.tolist(), ends.tolist(), triplets.tolist()))
         else:
             fout.write('Initial_frame-Final_frame-Subject-Relation-Object\n')
-        for _, key in sorted(df.start_frames):
-            start, end = dcomp[key]['contiguous'].pop(0)
-            subj, rel, obj = key
-            if keep_names:
-                fout.write('%d-%d %s %s %s\n' % (start, end, subj, rel, obj))
-            else:
-                fout.write('%d-%d-%d-%d-%d\n' % (start, end, do[subj], dr[rel], do[obj]))
+            subs, rels, objs = vocab.split(triplets)
+            fout.writelines('%d-%d-%d-%d-%d\n' % line
+                            for line in zip(starts.tolist(), ends.tolist(), subs.tolist(), rels.tolist(), objs.tolist()))
     logger.info('File saved at: %s' % output)
 
 
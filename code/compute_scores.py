@@ -1,20 +1,27 @@
 #!/usr/bin/env python
 # coding: utf-8
 """
-This script compute the acuracy score for each goal.
+This script compute the acuracy score for each goal. CSV files are scored
+by a pool of workers and, besides the results of each file, accuracy is
+aggregated by recipe and by split (the parent folder of the CSV file,
+e.g., `10/` or `30/` created by `split_observations.py`).
 """
 import sys
 import os
 import argparse
-from os.path import join, dirname, splitext, basename, isfile, isdir
+from os.path import join, dirname, splitext, basename, isfile, isdir, realpath
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 import filehandler as fh
-from matplotlib import pyplot as plt
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 
 # RECIPES[<filename>] = <column name in scores file> 
@@ -26,6 +33,29 @@ MAP = {'boiledegg': 'hard-boiled_egg',
 }
 
 
+def load_scores(csv_file):
+    """ Return the names of the goals and the matrix of scores (one row
+        per observation and one column per goal) of `csv_file`
+    """
+    with open(csv_file) as fin:
+        columns = fin.readline().strip().split(',')
+    # remove idfr column
+    names = columns[1:]
+    dtypes = dict([(name, np.float64) for name in names])
+    dtypes[columns[0]] = np.int64
+    dfull = pd.read_csv(csv_file, dtype=dtypes, engine='c')
+    return names, dfull[names].values
+
+
+def winners(scores):
+    """ Return a boolean matrix indicating the goals with the highest
+        score of each observation (row) of `scores`
+    """
+    if not scores.size:
+        return np.zeros(scores.shape, dtype=bool)
+    return scores == scores.max(axis=1)[:, np.newaxis]
+
+
 def plot_result(csv_file, name=''):
     """ Return the accuracy of scores according to the true class `name`. 
 
@@ -36,34 +66,44 @@ def plot_result(csv_file, name=''):
     """
     fname = fh.filename(csv_file, extension=False)
     fplot = join(dirname(csv_file), fname+'.png')
-    df_full = pd.read_csv(csv_file)
-    # remove idfr column
-    names = list(df_full.columns)[1:] 
-    df = df_full[names]
-
-    dnames = dict([(i, n) for i, n in enumerate(names)])
-    dic = dict([(i, []) for i, n in enumerate(names)])
-    for i, scores in enumerate(zip(df[names[0]], df[names[1]], df[names[2]], df[names[3]], df[names[4]])):
-        winner = np.argwhere(scores == np.amax(scores)).flatten().tolist()
-        for idname in dnames:
-            if idname in winner:
-                dic[idname].append(idname)
-            else:
-                dic[idname].append(-1)
-
-    plt.figure(figsize=(15,10))
-    size = len(dic[0])
-    for key in dic:
-        plt.scatter(range(size), dic[key])
-    plt.ylim(-0.5, 4.5)
-    plt.yticks(range(len(names)), names)
-    plt.legend(names)
-    plt.savefig(fplot)
-    #plt.show()
-
-
-def compute_accuracy(csv_file, name=''):
-    """ Return the accuracy of scores according to the true class `name`. 
+    names, scores = load_scores(csv_file)
+    win = winners(scores)
+
+    # it does not use the global state of pyplot to be executed by workers
+    fig = Figure(figsize=(15,10))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    size = len(win)
+    for idname in range(len(names)):
+        ax.scatter(range(size), np.where(win[:, idname], idname, -1))
+    ax.set_ylim(-0.5, len(names)-0.5)
+    ax.set_yticks(range(len(names)))
+    ax.set_yticklabels(names)
+    ax.legend(names)
+    fig.savefig(fplot)
+    return fplot
+
+
+def accuracy(names, scores, true_name):
+    """ Return the accuracy, number of correct observations, spread,
+        number of observations and number of ties of `scores` (see
+        `compute_accuracy`) according to the goal `true_name`
+    """
+    win = winners(scores)
+    nb_obs = len(win)
+    candidates = win.sum(axis=1)
+    correct = int(win[:, names.index(true_name)].sum()) if true_name in names else 0
+    ties = int((candidates > 1).sum())
+    acc = float(correct)/nb_obs if nb_obs else 0.
+    spread = float(candidates.sum())/nb_obs if nb_obs else 0.
+    return acc, correct, spread, nb_obs, ties
+
+
+def compute_accuracy(csv_file, name='', ties=False):
+    """ Return (accuracy, correct, spread, nb_obs) of scores according to
+        the true class `name`. All goals with the highest score of an
+        observation are candidates, thus, `spread` is the average number
+        of candidates.
 
     Parameters:
     -----------
@@ -71,26 +111,46 @@ def compute_accuracy(csv_file, name=''):
         csv file containing scores from the goal recognizer
     name: string
         name of the file according to the key of the MAP dictionary
+    ties: boolean
+        append the number of observations with more than one candidate
+        to the output
     """
-    dfull = pd.read_csv(csv_file)
-    names = list(dfull.columns)[1:]
-    df = dfull[names]
-
-    correct, candidates = 0, 0
-    for i, scores in enumerate(zip(df[names[0]], df[names[1]], 
-                                   df[names[2]], df[names[3]], df[names[4]])):
-        winner = np.argwhere(scores == np.amax(scores)).flatten().tolist()
-        candidates += len(winner)
-        for w in winner:
-            if names[w] == MAP[name]:
-                correct += 1
-        nb_obs = df[names[0]].size
-        acc = float(correct)/nb_obs
-        spread = float(candidates)/nb_obs
-    return acc, correct, spread, nb_obs
-
-
-def compute_from_folder(folder_input, output, plot=False):
+    names, scores = load_scores(csv_file)
+    result = accuracy(names, scores, MAP[name])
+    if ties:
+        return result
+    return result[:4]
+
+
+def score_file(file_score):
+    """ Compute the accuracy of a CSV file (executed by workers). The name of
+        the file contains the recipe after '-' (e.g. `scores-boiledegg.csv`)
+        and its parent folder is the split.
+    """
+    fname = fh.filename(file_score, extension=False).split('-')[1]
+    # fname = boiledegg
+    split = basename(dirname(file_score))
+    acc, correct, spread, nb_obs, ties = compute_accuracy(file_score, name=fname, ties=True)
+    return file_score, split, fname, acc, correct, spread, nb_obs, ties
+
+
+def plot_file(file_score):
+    """ Save the plot of a CSV file (executed by workers) """
+    fname = fh.filename(file_score, extension=False).split('-')[1]
+    return plot_result(file_score, name=fname)
+
+
+def aggregate(df, key):
+    """ Aggregate the results of files (see `score_file`) by `key` """
+    df = df.assign(candidates=df['spread']*df['observations'])
+    table = df.groupby(key)[['correct', 'candidates', 'observations', 'ties']].sum()
+    table.insert(0, 'files', df.groupby(key).size())
+    table.insert(1, 'accuracy', table['correct']/table['observations'])
+    table.insert(3, 'spread', table['candidates']/table['observations'])
+    return table.drop(columns='candidates')
+
+
+def compute_from_folder(folder_input, output, plot=False, nb_workers=None):
     """ Receives a folder containing files with scores for each
         goal.
 
@@ -99,26 +159,48 @@ def compute_from_folder(folder_input, output, plot=False):
     folder_input: string
         path to the folder containing files with relations
     output: string
-        path to the file where the goals are saved.
+        path to the file where the goals are saved. The results of each
+        file and tables aggregated by recipe and by split are also saved
+        as CSV files (`<output>.csv`, `<output>_recipe.csv` and
+        `<output>_split.csv`).
+    plot: boolean
+        save a plot for each file
+    nb_workers: int (optional)
+        number of processes (default: number of CPUs)
     """
     if not output:
         output = join(folder_input, 'results.txt')
  
-    drecipes = {}
-    filescores = fh.FolderHandler(folder_input, ext='csv')
+    files = list(fh.FolderHandler(folder_input, ext='csv'))
+    # skip tables from a previous output inside the input folder
+    prefix = splitext(output)[0]
+    tables = [prefix+'.csv', prefix+'_recipe.csv', prefix+'_split.csv']
+    skip = [realpath(table) for table in tables]
+    files = [path for path in files if realpath(path) not in skip]
+
+    pool = Pool(nb_workers)
+    plots = pool.map_async(plot_file, files) if plot else None
+    results = []
     with open(output, 'w') as fout:
-        for file_score in filescores:
-            logger.info('Reading file: {}'.format(file_score))
-            fname = fh.filename(file_score, extension=False).split('-')[1]
-            # fname = boiledegg
-            acc, correct, spread, nb_obs = compute_accuracy(file_score, name=fname)
-            fout.write('{}: \n\tAccuracy: {}\n\tCorrect: {}\n\tSpread: {}\n\tObservations: {}\n\n'.format(
-                fname, acc, correct, spread, nb_obs)
+        for file_score, split, fname, acc, correct, spread, nb_obs, ties in pool.imap(score_file, files):
+            logger.info('Read file: {}'.format(file_score))
+            fout.write('{}: \n\tAccuracy: {}\n\tCorrect: {}\n\tSpread: {}\n\tObservations: {}\n\tTies: {}\n\n'.format(
+                fname, acc, correct, spread, nb_obs, ties)
             )
-            if plot:
-                plot_result(file_score, name=fname)
-            
+            results.append((file_score, split, fname, acc, correct, spread, nb_obs, ties))
+    if plots is not None:
+        logger.info('Saved {} plots'.format(len(plots.get())))
+    pool.close()
+    pool.join()
     logger.info('Accuracy scores saved in file: {}'.format(output))
+
+    df = pd.DataFrame(results, columns=['file', 'split', 'recipe', 'accuracy', 'correct', 'spread', 'observations', 'ties'])
+    df.to_csv(tables[0], index=False)
+    for key, ftable in (('recipe', tables[1]), ('split', tables[2])):
+        table = aggregate(df, key)
+        table.to_csv(ftable)
+        logger.info('Accuracy by {}:\n{}'.format(key, table.to_string()))
+    logger.info('Aggregated tables saved in files: {}'.format(', '.join(tables)))
     
 
 if __name__ == '__main__':
@@ -126,10 +208,10 @@ if __name__ == '__main__':
     parser.add_argument('input', metavar='input_folder', help='Plain text file')
     parser.add_argument('-o', '--output', help='Plain text file', default=None)
     parser.add_argument('-p', '--plot', help='Save a plot file', action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
     args = parser.parse_args()
 
     if isfile(args.input):
-        compute_from_folder(args.input, args.output, args.plot)
+        compute_from_folder(args.input, args.output, args.plot, args.workers)
     elif isdir(args.input):
-        compute_from_folder(args.input, args.output, args.plot)
-    
+        compute_from_folder(args.input, args.output, args.plot, args.workers)
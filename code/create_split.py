@@ -2,49 +2,104 @@
 #-*- coding: utf-8 -*-
 """
 This script creates a random split of training and validation sets.
+The split is computed on unique images (not on bounding boxes) and can be
+grouped by recording, i.e., all images of a recording (or blocks of
+consecutive images of a recording) belong to the same set, and stratified
+by recipe and/or by the rarest object class of each image.
 """
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import argparse
-from os.path import dirname, join
-import random
+from os.path import dirname, join, basename, splitext
 
-import utils
+import numpy as np
+
+import lis
+import split_engine as se
 
 SIZE_TRAIN=0.8 # 80 percent of the dataset
 
-def split_train_test(vfiles, size_train, perc=True):
-    """ Split dataset into train and test sets. When perc=True,
-        the value of `size_train` must be between 0 and 1
+def load_boxes(inputfile):
+    """ Read the paths and objects of the boxes of a LIS file. Boxes with
+        `None` objects are skipped, thus, images without objects are not
+        split (as in `utils.images_from_file`).
+
+        Output: (paths, frames, objects) where `paths` contains the unique
+            paths of images and `frames` the index of the path of each box
     """
-    random_list = vfiles[:]
-    random.shuffle(random_list)
-    if perc:
-        sizev = len(random_list)
-        size_train = int(sizev*size_train)
-    vtrain = random_list[:size_train]
-    vtest = random_list[size_train:]
-    return vtrain, vtest
+    paths, frames, objects = [], [], []
+    dpaths = {}
+    with lis.LIS(inputfile) as flis:
+        for _ in flis:
+            if flis.obj == 'None': continue
+            path = join(flis.path, flis.fname)
+            if path not in dpaths:
+                dpaths[path] = len(paths)
+                paths.append(path)
+            frames.append(dpaths[path])
+            objects.append(flis.obj)
+    logger.info('Loaded %d boxes of %d images.' % (len(frames), len(paths)))
+    return paths, np.array(frames, dtype=np.int64), objects
+
 
+def main(inputfile, dirout=None, seed=None, group=False, block=None, stratify=None):
+    """ Split images of `inputfile` into train and test files.
 
-def main(inputfile, dirout=None):
+        Parameters:
+        -----------
+        seed: int (optional)
+            seed of the random generator
+        group: boolean
+            keep images of the same recording in the same set
+        block: int (optional)
+            keep blocks of `block` consecutive images of a recording in
+            the same set
+        stratify: list (optional)
+            keep the proportion of `recipe` and/or `class` (rarest object
+            class of the image) in both sets
+    """
     if not dirout:
         dirout = dirname(inputfile)
-    vnames = utils.images_from_file(inputfile, extension=False)
-    vtrain, vtest = split_train_test(vnames, SIZE_TRAIN, perc=True)
-    with open(join(dirout, 'train.txt'), 'w') as fout:
-        for idfile in vtrain:
-            fout.write('%s\n' % idfile)
-    with open(join(dirout, 'test.txt'), 'w') as fout:
-        for idfile in vtest:
-            fout.write('%s\n' % idfile)
-    
+    paths, frames, objects = load_boxes(inputfile)
+    ids = np.arange(len(paths))
+    recordings = [dirname(path) for path in paths]
+
+    groups = None
+    if block:
+        numbers = [int(splitext(basename(path))[0]) for path in paths]
+        groups = se.combine(recordings, np.array(numbers)//block)
+    elif group:
+        groups = recordings
+        if len(set(recordings)) == 1:
+            logger.warning('All images belong to the same recording: %s' % recordings[0])
+
+    strata = None
+    if stratify:
+        labels = []
+        if 'recipe' in stratify:
+            labels.append([basename(rec) for rec in recordings])
+        if 'class' in stratify:
+            # every image has at least one object
+            _, rarest = se.rarest_class(frames, se.encode(objects))
+            labels.append(rarest)
+        strata = se.combine(*labels)
+
+    vtrain, vtest = se.split_ids(ids, [SIZE_TRAIN, 1-SIZE_TRAIN], groups=groups, strata=strata, seed=seed)
+    logger.info('Split %d images into %d for training and %d for testing.' % (len(ids), len(vtrain), len(vtest)))
+    for fname, vids in (('train.txt', vtrain), ('test.txt', vtest)):
+        with open(join(dirout, fname), 'w') as fout:
+            for idfile in vids:
+                fout.write('%s\n' % splitext(basename(paths[idfile]))[0])
+
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
     argparser.add_argument('inputfile', metavar='file_input', help='Path to the file containing paths of the dataset.')
     argparser.add_argument('-o', '--output', help='Path to the folder where train and test files are saved.', default=None)
+    argparser.add_argument('-s', '--seed', help='Seed of the random generator', type=int, default=None)
+    argparser.add_argument('-g', '--group', help='Keep images of the same recording in the same set', action='store_true')
+    argparser.add_argument('-b', '--block', help='Keep blocks of consecutive images of a recording in the same set', type=int, default=None)
+    argparser.add_argument('-t', '--stratify', help='Keep the proportion of recipes and/or rarest object classes', nargs='+', choices=['recipe', 'class'], default=None)
     args = argparser.parse_args()
-    main(args.inputfile, args.output)
-
+    main(args.inputfile, args.output, args.seed, args.group, args.block, args.stratify)
@@ -4,6 +4,9 @@
 This script creates train, validation, trainval and test files.
 In KSCGR we use all images from data3 as validation and data6 and data7
 as testing set. Thus, training set is composed by data1, data2, data4 and data5.
+The assignment of data folders to splits can be changed with `--split`, e.g.:
+
+    --split data1 train --split data2 val --split data3 test
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -14,67 +17,100 @@ import shutil
 import argparse
 from os.path import splitext, basename, isdir, join, dirname
 
-import lis
-import progressbar
+import mapstore
 
-def main(lis_file, map_file):
-    """   
-    """
-    TRAIN = ['data1', 'data2', 'data4', 'data5']
-    VAL = ['data3']
-    TEST = ['data6', 'data7'] #TODO: Annotate test files
+# data folder -> split
+SPLITS = {
+    'data1': 'train', 'data2': 'train', 'data4': 'train', 'data5': 'train',
+    'data3': 'val',
+    'data6': 'test', 'data7': 'test', #TODO: Annotate test files
+}
+# files containing images of each split
+FILES = {
+    'train': ['train', 'trainval'],
+    'val': ['val', 'trainval'],
+    'test': ['test'],
+}
 
-    ftrain = join(dirname(lis_file), 'train.txt')
-    ftrainval = join(dirname(lis_file), 'trainval.txt')
-    fval = join(dirname(lis_file), 'val.txt')
-    ftest = join(dirname(lis_file), 'test.txt')
 
-    dpaths = {}
-    with open(map_file) as fin:
+def annotated_frames(lis_file):
+    """ Return the list of (data, recipe, frame) of the images in `lis_file`,
+        i.e., one entry per image instead of one entry per bounding box.
+        Only the path at the end of each line is read.
+    """
+    keys = []
+    last_path = None
+    last_folder = None
+    with open(lis_file) as fin:
         for line in fin:
-            path_kscgr, path_voc = line.strip().split(' : ')
-            dpaths[path_kscgr] = path_voc
+            if not line[0].isdigit(): continue
+            path = line.strip().rsplit('\t', 1)[-1]
+            if path == last_path: continue
+            last_path = path
+            folder = dirname(path)
+            if folder != last_folder:
+                logger.info('Processing: %s' % folder)
+                last_folder = folder
+            keys.append(mapstore.split_kscgr(path)[1:4])
+    return keys
 
-    lis_annotation = lis.LIS(lis_file)
-    dtra, dval, dtrv, dtst = {}, {}, {}, {}
-    with lis_annotation as flis:
-        last_path = ''
-        for content in flis:
-            path = '/'.join(content[4].split('/')[1:7])
-            if path != last_path:
-                logger.info('Processing: /%s' % path)
-                last_path = path
-            data = content[4].split('/')[5]
-            fname, _ = splitext(basename(dpaths[content[4]]))
-            fname = int(fname)
-            if data in TRAIN: dtra[fname] = ''
-            if data in TRAIN or data in VAL: dtrv[fname] = ''
-            if data in VAL: dval[fname] = ''
-            if data in TEST: dtst[fname] = ''
 
-    with open(ftrain, 'w') as fout:
-        for fname in sorted(dtra):
-            fout.write('%s\n' % str(fname).zfill(6))
-    with open(ftrainval, 'w') as fout:
-        for fname in sorted(dtrv):
-            fout.write('%s\n' % str(fname).zfill(6))
-    with open(fval, 'w') as fout:
-        for fname in sorted(dval):
-            fout.write('%s\n' % str(fname).zfill(6))
-    #with open(ftest, 'w') as fout:
-    #    for fname in sorted(dtst):
-    #        fout.write('%s\n' % str(fname).zfill(6))
+def main(lis_file, map_file, splits=SPLITS):
+    """ Create the files of each split in the folder of `lis_file`. Images
+        are assigned to splits by the `splits` dictionary containing the data
+        folder as key and the split (train, val or test) as value.
+    """
+    keys = annotated_frames(lis_file)
+    logger.info('Found %d annotated images' % len(keys))
+    store = mapstore.load_store(map_file)
+    voc_ids = store.voc_ids(keys)
+    store.close()
+
+    frames = set()
+    nb_ignored = 0
+    for key, voc_id in zip(keys, voc_ids):
+        if voc_id is None:
+            logger.warning('Could not map file! Key do not exist. %s' % '/'.join(map(str, key)))
+        elif key[0] not in splits:
+            nb_ignored += 1
+        else:
+            frames.add((voc_id, splits[key[0]]))
+    if nb_ignored:
+        logger.warning('%d images from folders without split were ignored' % nb_ignored)
 
-    # REMOVE after annotating TEST files
-    with open(ftest, 'w') as fout:
-        for i in range(fname+1, fname+55783):
-            fout.write('%s\n' % str(i).zfill(6))
+    # write all files in a single pass sorted by VOC ids
+    names = ['train', 'trainval', 'val', 'test']
+    fouts = dict([(name, open(join(dirname(lis_file), name+'.txt'), 'w')) for name in names])
+    counter = dict([(name, 0) for name in names])
+    last_id = 0
+    try:
+        for voc_id, split in sorted(frames):
+            for name in FILES[split]:
+                fouts[name].write('%s\n' % str(voc_id).zfill(6))
+                counter[name] += 1
+            last_id = voc_id
+        # REMOVE after annotating TEST files
+        if not counter['test']:
+            logger.warning('No images in test split: saving placeholder ids after %d' % last_id)
+            for i in range(last_id+1, last_id+55783):
+                fouts['test'].write('%s\n' % str(i).zfill(6))
+    finally:
+        for fout in fouts.values():
+            fout.close()
+    for name in names:
+        logger.info('Saved %d images in %s' % (counter[name], fouts[name].name))
 
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
     argparser.add_argument('lis_file', metavar='lis_annotation', help='Path to the file containing the LIS annotation.')
     argparser.add_argument('map_file', metavar='map_file', help='Path to the file containing the mapping between KSCGR and VOC.')
+    argparser.add_argument('-s', '--split', help='Data folder and its split (train, val or test). Replaces the default assignment.', nargs=2, action='append', metavar=('FOLDER', 'SPLIT'), default=None)
     args = argparser.parse_args()
-    main(args.lis_file, args.map_file)
-
+    splits = SPLITS
+    if args.split:
+        splits = dict(args.split)
+        for split in splits.values():
+            if split not in FILES:
+                argparser.error("invalid split '%s' (choose from %s)" % (split, ', '.join(sorted(FILES))))
+    main(args.lis_file, args.map_file, splits)
@@ -1,13 +1,17 @@
 #!/usr/bin/env python
 # coding: utf-8
 """
-This script reads a folder and decompress all files inside the folder
+This script reads a folder and decompress all files inside the folder.
+Dictionaries of objects and relations are loaded once and files are
+decompressed by a pool of workers. Each output file is written with a
+temporary name and renamed when it is complete.
 
 """
 import sys
 import os
 import argparse
-from os.path import join, basename
+from os.path import join, basename, realpath
+from multiprocessing import Pool
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
@@ -16,16 +20,57 @@ import filehandler as fh
 import decompress_relations as dr 
 
 
-def decompress_data(folder_input, output=None, class_file='classes.cfg', rels_file='relations.cfg'):
+def decompress_file(task):
+    """ Decompress a single file (executed by workers). Errors (including
+        `sys.exit` of malformed files) are returned instead of raised,
+        thus, a bad file does not stop the pool.
+
+        Output: (file_input, foutput, error) where `error` is None for
+            files that were decompressed
+    """
+    file_input, foutput, dicts = task
+    ftmp = foutput+'.part'
+    try:
+        dr.decompress_relations(file_input, output=ftmp, dicts=dicts)
+    except (Exception, SystemExit) as err:
+        if os.path.exists(ftmp):
+            os.remove(ftmp)
+        return file_input, foutput, repr(err)
+    os.rename(ftmp, foutput)
+    return file_input, foutput, None
+
+
+def decompress_data(folder_input, output=None, class_file='classes.cfg', rels_file='relations.cfg', nb_workers=None):
     if not output:
         output = join(folder_input, 'decompressed.tmp')
         output = fh.mkdir_from_file(output)
 
-    # load files
+    dicts = dr.load_dictionaries(class_file, rels_file)
+    logger.info('Loaded dictionaries with {} objects and {} relations.'.format(len(dicts[False][0]), len(dicts[False][1])))
+
+    # load files (skipping files from a previous output inside the input folder)
     compfiles = fh.FolderHandler(folder_input)
+    tasks = []
     for file_input in compfiles:
-        foutput = join(output, basename(file_input))
-        dr.decompress_relations(file_input, output=foutput, class_file=class_file, rels_file=rels_file)
+        if realpath(file_input).startswith(realpath(output)+os.sep): continue
+        tasks.append((file_input, join(output, basename(file_input)), dicts))
+
+    pool = Pool(nb_workers)
+    errors = []
+    for file_input, foutput, error in pool.imap_unordered(decompress_file, tasks):
+        if error:
+            logger.error('Could not decompress file: {} ({})'.format(file_input, error))
+            errors.append(file_input)
+        else:
+            logger.info('Decompressed file: {}'.format(foutput))
+    pool.close()
+    pool.join()
+    logger.info('Decompressed {} files into: {}'.format(len(tasks)-len(errors), output))
+    if errors:
+        logger.error('Failed to decompress {} files:'.format(len(errors)))
+        for file_input in sorted(errors):
+            logger.error('- {}'.format(file_input))
+    return errors
 
 
 if __name__ == '__main__':
@@ -34,6 +79,7 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', help='Output folder', default=None)
     parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
     parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
     args = parser.parse_args()
     
-    decompress_data(args.input, args.output, args.class_file, args.relation_file)
+    decompress_data(args.input, args.output, args.class_file, args.relation_file, args.workers)
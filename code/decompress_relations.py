@@ -39,7 +39,8 @@ import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
-from collections import defaultdict
+import heapq
+from collections import Counter
 
 import filehandler as fh
 
@@ -56,74 +57,138 @@ def check_error(do, dr, o1, r, o2):
     return
 
 
-def save_aligned_with_objects(drels, object_file, do, dr, output, cnames=False, screen=True):
-    """ Save only relations that contain the object in the frame """
+def stream_frames(intervals):
+    """ Yield the relations of each frame from the first to the last frame of
+        `intervals`. Intervals are kept in a heap ordered by their initial
+        frame, thus, only relations active at the current frame are expanded
+        in memory. Relations of a frame keep the order of the intervals.
+
+        Parameters:
+        -----------
+        intervals: list
+            list containing (start, end, (o1, r, o2)) for each compressed line
+
+        Output: (id_frame, [(o1, r, o2), ...])
+    """
+    pending = [(start, i, end, triplet) for i, (start, end, triplet) in enumerate(intervals)]
+    if not pending:
+        return
+    last = max(end for _, _, end, _ in pending)
+    heapq.heapify(pending)
+    active = {}
+    ending = []
+    relations = []
+    changed = False
+    for idfr in range(last+1):
+        while pending and pending[0][0] <= idfr:
+            _, i, end, triplet = heapq.heappop(pending)
+            active[i] = triplet
+            heapq.heappush(ending, (end, i))
+            changed = True
+        if changed:
+            relations = [active[i] for i in sorted(active)]
+            changed = False
+        yield idfr, relations
+        while ending and ending[0][0] <= idfr:
+            _, i = heapq.heappop(ending)
+            del active[i]
+            changed = True
+
+
+def save_aligned_with_objects(frames, object_file, output):
+    """ Save only relations that contain the object in the frame. Relations
+        and objects are merged by the id of the frame and relations without
+        their objects are reported at the end.
+    """
+    missing = Counter()
+    frames_missing = 0
     flis = fh.LisFile(object_file)
     with open(output, 'w') as fout, flis as fobjs:
         fout.write('Frame\tSubject\tRelation\tObject\n')
-        for idfr, vobjs in fobjs.objects_in_frame():
-            # vobjs = ['pan', 'bowl', 'shell_egg']
-            if drels.has_key(idfr):
-                arr = drels[idfr]
-                for o1, r, o2 in arr:
-                    check_error(do, dr, o1, r, o2)
-                    if not cnames:
-                        o1, r, o2 = do[o1], dr[r], do[o2]
-                        if o1 not in vobjs or o2 not in vobjs:
-                            if screen:
-                                print 'Frame {} does not contain some of the elements {}: {}'.format(idfr, (do[o1], do[o2]), vobjs)
-                            else:
-                                logger.warning('Frame {} does not contain some of the elements {}: {}'.format(idfr, (do[o1], do[o2]), vobjs))
-                            continue
-                    fout.write('%d\t%s\t%s\t%s\n' % (idfr, o1, r, o2))
+        idrel, arr = next(frames, (None, []))
+        for idfr, vobjs in fobjs.object_sets():
+            # vobjs = set(['pan', 'bowl', 'shell_egg'])
+            while idrel is not None and idrel < idfr:
+                idrel, arr = next(frames, (None, []))
+            if idrel != idfr or not arr:
+                fout.write('%d\tNone\tNone\tNone\n' % idfr)
+                continue
+            lines = ['%d\t%s\t%s\t%s\n' % (idfr, o1, r, o2) for o1, r, o2 in arr if o1 in vobjs and o2 in vobjs]
+            if len(lines) < len(arr):
+                frames_missing += 1
+                missing.update(triplet for triplet in arr if triplet[0] not in vobjs or triplet[2] not in vobjs)
+            if lines:
+                fout.writelines(lines)
             else:
                 fout.write('%d\tNone\tNone\tNone\n' % idfr)
+    if missing:
+        logger.warning('Removed {} relations from {} frames that do not contain their objects:'.format(
+                       sum(missing.values()), frames_missing))
+        for (o1, r, o2), nb in missing.most_common():
+            logger.warning('- ({}, {}, {}): {} frames'.format(o1, r, o2, nb))
     return
 
 
-def save_aligned_no_objects(drels, do, dr, output, cnames=False, screen=True):
-    """ Save all relations from `drels` in a file """
+def save_aligned_no_objects(frames, output):
+    """ Save all relations from `frames` in a file """
     with open(output, 'w') as fout:
         fout.write('Frame\tSubject\tRelation\tObject\n')
-        last = max(drels.keys())
-        for idfr in range(last+1):
-            if drels.has_key(idfr):
-                for o1, r, o2 in drels[idfr]:
-                    check_error(do, dr, o1, r, o2)
-                    if not cnames:
-                        o1, r, o2 = do[o1], dr[r], do[o2]
+        for idfr, arr in frames:
+            if arr:
+                for o1, r, o2 in arr:
                     fout.write('%d\t%s\t%s\t%s\n' % (idfr, o1, r, o2))
             else:
                 fout.write('%d\tNone\tNone\tNone\n' % idfr)
     return
 
 
-def decompress_relations(file_input, output=None, class_file='classes.cfg', rels_file='relations.cfg', object_file=None):
+def load_dictionaries(class_file='classes.cfg', rels_file='relations.cfg'):
+    """ Load dictionaries of objects and relations for compressed files
+        containing ids (False) and names (True) as {cnames: (do, dr)}
+    """
+    dicts = {}
+    for cnames in (False, True):
+        do = fh.ConfigFile(class_file).load_classes(cnames=cnames)
+        dr = fh.ConfigFile(rels_file).load_classes(cnames=cnames)
+        dicts[cnames] = (do, dr)
+    return dicts
+
+
+def decompress_relations(file_input, output=None, class_file='classes.cfg', rels_file='relations.cfg', object_file=None, dicts=None):
     if not output:
         fname, _ = splitext(basename(file_input))
         output = join(dirname(file_input), fname+'_decompressed.txt')
 
-    # Load relations as {idf1: [(s,r,o),(s,r,o)...], idf2: [(s,r,o)]...}
-    drels = defaultdict(list)
+    # Load compressed lines as [(start, end, (s,r,o)), ...]
+    intervals = []
     fc = fh.CompressedFile(file_input)
     with fc as fin:
         for start, end, o1, r, o2 in fin:
-            for j in range(start, end+1):
-                drels[j].append((o1, r, o2))
+            intervals.append((start, end, (o1, r, o2)))
         class_names = fc.cnames
     logger.info('Found {} lines in compressed input file.'.format(fc.nb_lines))
 
     # Load classes for objects from dict {0: 'rel0', 1: 'rel1'}
-    do = fh.ConfigFile(class_file).load_classes(cnames=class_names)
-    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
-    dr = fh.ConfigFile(rels_file).load_classes(cnames=class_names)
-    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+    if dicts:
+        do, dr = dicts[class_names]
+    else:
+        do = fh.ConfigFile(class_file).load_classes(cnames=class_names)
+        logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+        dr = fh.ConfigFile(rels_file).load_classes(cnames=class_names)
+        logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+
+    # Check and convert ids into names once for each compressed line
+    for i, (start, end, (o1, r, o2)) in enumerate(intervals):
+        check_error(do, dr, o1, r, o2)
+        if not class_names:
+            intervals[i] = (start, end, (do[o1], dr[r], do[o2]))
 
     logger.info('Uncompressing and saving output file...')
+    frames = stream_frames(intervals)
     if object_file:
-        save_aligned_with_objects(drels, object_file, do, dr, output, cnames=class_names, screen=True)
+        save_aligned_with_objects(frames, object_file, output)
     else:
-        save_aligned_no_objects(drels, do, dr, output, cnames=class_names, screen=True)
+        save_aligned_no_objects(frames, output)
     logger.info('File saved at: %s' % output)
 
 
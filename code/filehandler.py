@@ -7,9 +7,17 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import os
 import sys
 import ast
-#import lxml.etree as ET
+try:
+    import lxml.etree as ET
+except ImportError:
+    ET = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 from os.path import exists, join, splitext, dirname, basename, realpath
+from xml.sax.saxutils import escape
 
 def is_file(inputfile):
     """ Check whether the ``inputfile`` corresponds to a file """
@@ -190,9 +198,9 @@ class LisFile(FileHandler):
                 objs = self.idobj
         else:
             if pos:
-                objs = (self.dobj, self.x, self.y. self.w, self.h)
+                objs = (self.obj, self.x, self.y, self.w, self.h)
             else:
-                objs = self.dobj
+                objs = self.obj
         return objs
 
     def objects_in_frame(self, ids=False, pos=False):
@@ -208,6 +216,20 @@ class LisFile(FileHandler):
                 objs.append(self._add_element(ids, pos))
         yield self.idfr, objs
 
+    def object_sets(self):
+        """ Yield the id of the frame and the set of objects in the frame """
+        last_id = None
+        objs = set()
+        for _ in self:
+            if self.idfr != last_id:
+                if last_id is not None:
+                    yield last_id, objs
+                last_id = self.idfr
+                objs = set()
+            objs.add(self.obj)
+        if last_id is not None:
+            yield last_id, objs
+
     def iterate_frames(self):
         last_id = -1
         objs = []
@@ -546,8 +568,8 @@ class VOCFile(object):
         ET.SubElement(imsize, 'depth').text = '3'
         ET.SubElement(self.xml, 'segmented').text = '0' 
 
-    def add_object(self, name, x, y, w, h):
-        """ Add the annotation for an object """
+    def bounding_box(self, x, y, w, h):
+        """ Return (xmin, ymin, xmax, ymax) of a box inside the image """
         # VOC cannot have xmin or ymin equals zero
         if x <= 0: 
             w -= x-1
@@ -563,7 +585,11 @@ class VOCFile(object):
             xmax = 256
         if ymax > 256:
             ymax = 256
+        return xmin, ymin, xmax, ymax
 
+    def add_object(self, name, x, y, w, h):
+        """ Add the annotation for an object """
+        xmin, ymin, xmax, ymax = self.bounding_box(x, y, w, h)
         obj = ET.SubElement(self.xml, "object")
         ET.SubElement(obj, "name").text = name
         ET.SubElement(obj, "pose").text = "Unspecified"
@@ -583,6 +609,72 @@ class VOCFile(object):
         tree.write(fileout, pretty_print=True)
 # End of VOCFile class
 
+
+class VOCTemplate(VOCFile):
+    """ Serialize the VOC annotation of an image with string templates
+        instead of building the XML tree. The output is byte-identical
+        to `VOCFile.save_xml` (i.e., lxml with pretty_print).
+    """
+    HEADER = (
+        '<annotations>\n'
+        '  <folder>JPEGImages</folder>\n'
+        '  <filename>%s</filename>\n'
+        '  <size>\n'
+        '    <width>%s</width>\n'
+        '    <height>%s</height>\n'
+        '    <depth>3</depth>\n'
+        '  </size>\n'
+        '  <segmented>0</segmented>\n'
+    )
+    OBJECT = (
+        '  <object>\n'
+        '    <name>%s</name>\n'
+        '    <pose>Unspecified</pose>\n'
+        '    <truncated>0</truncated>\n'
+        '    <difficult>0</difficult>\n'
+        '    <bndbox>\n'
+        '      <xmin>%s</xmin>\n'
+        '      <ymin>%s</ymin>\n'
+        '      <xmax>%s</xmax>\n'
+        '      <ymax>%s</ymax>\n'
+        '    </bndbox>\n'
+        '  </object>\n'
+    )
+    FOOTER = '</annotations>\n'
+
+    def _create_header(self):
+        """ Start the list of blocks of the XML with the header """
+        self.blocks = [self.HEADER % (escape_xml(self.filename), self.width, self.height)]
+        self.names = {}
+
+    def add_object(self, name, x, y, w, h):
+        """ Add the annotation for an object """
+        if name not in self.names:
+            self.names[name] = escape_xml(name)
+        self.blocks.append(self.OBJECT % ((self.names[name],)+self.bounding_box(x, y, w, h)))
+
+    def tostring(self):
+        """ Return the content of the XML file """
+        return ''.join(self.blocks)+self.FOOTER
+
+    def save_xml(self, folderout):
+        """ Save the XML corresponding to an image in folderout """
+        fname, _ = splitext(self.filename)
+        fileout = join(folderout, fname+'.xml')
+        with open(fileout, 'w') as fout:
+            fout.write(self.tostring())
+# End of VOCTemplate class
+
+
+def escape_xml(text):
+    """ Escape `text` as lxml does for the content of elements written
+        in ASCII, i.e., replacing non-ASCII characters by references.
+    """
+    text = escape(text)
+    if isinstance(text, bytes):
+        return text
+    return text.encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
 class PathFile(FileHandler):
     """ Path file has the form:
         Frame path <SPACE> [Class]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script builds an interval tree from a Compressed file containing:
+
+Initial_frame - Final_frame - Id_subject - Id_relation - Id_object
+
+in order to answer which relations hold at a frame, or which relations
+overlap a range of frames, without decompressing the file. Both queries
+take O(log n + k) for n compressed lines and k relations in the answer.
+
+Thus, for a file containing:
+
+0-4-1-3-7
+1-2-1-4-7
+4-4-7-1-17
+
+relations at frame 2 are [(1, 3, 7), (1, 4, 7)] and relations between
+frames 3 and 4 are [(0, 4, (1, 3, 7)), (4, 4, (7, 1, 17))].
+"""
+import argparse
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import numpy as np
+
+import filehandler as fh
+
+
+class IntervalTree(object):
+    """ Centered interval tree over closed intervals [start, end]. Each node
+        keeps the intervals that contain its center sorted by start and by
+        end, so that intervals of a node are selected with a binary search.
+    """
+    def __init__(self, starts, ends):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.root = self._build(np.arange(len(self.starts)))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _build(self, idx):
+        """ Node as (center, by_start, sorted_starts, by_end, sorted_ends, left, right) """
+        if not len(idx):
+            return None
+        starts, ends = self.starts[idx], self.ends[idx]
+        center = np.median(np.concatenate((starts, ends)))
+        inner = idx[(starts <= center) & (ends >= center)]
+        by_start = inner[np.argsort(self.starts[inner], kind='mergesort')]
+        # ends are sorted in decreasing order as negative values
+        by_end = inner[np.argsort(-self.ends[inner], kind='mergesort')]
+        return (center, by_start, self.starts[by_start], by_end, -self.ends[by_end],
+                self._build(idx[ends < center]), self._build(idx[starts > center]))
+
+    def overlap(self, first, last=None):
+        """ Return the (sorted) ids of intervals that overlap the frames
+            from `first` to `last`. When `last` is not informed, return the
+            intervals that contain the frame `first`.
+        """
+        if last is None:
+            last = first
+        found = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node is None:
+                continue
+            center, by_start, sorted_starts, by_end, sorted_ends, left, right = node
+            if last < center:
+                found.append(by_start[:np.searchsorted(sorted_starts, last, side='right')])
+                nodes.append(left)
+            elif first > center:
+                found.append(by_end[:np.searchsorted(sorted_ends, -first, side='right')])
+                nodes.append(right)
+            else:
+                found.append(by_start)
+                nodes.append(left)
+                nodes.append(right)
+        if not found:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(found))
+# End of IntervalTree class
+
+
+class RelationIndex(object):
+    """ Index of relations of a Compressed file """
+    def __init__(self, inputfile):
+        starts, ends = [], []
+        self.triplets = []
+        fc = fh.CompressedFile(inputfile)
+        with fc as fin:
+            for start, end, o1, r, o2 in fin:
+                starts.append(start)
+                ends.append(end)
+                self.triplets.append((o1, r, o2))
+        self.cnames = fc.cnames
+        self.tree = IntervalTree(starts, ends)
+        logger.info('Indexed {} relations from: {}'.format(len(self.tree), inputfile))
+
+    def __len__(self):
+        return len(self.triplets)
+
+    def nb_frames(self):
+        if not len(self.tree):
+            return 0
+        return int(self.tree.ends.max())+1
+
+    def relations_at(self, frame):
+        """ Return the list of (o1, r, o2) that hold at `frame` """
+        return [self.triplets[i] for i in self.tree.overlap(frame)]
+
+    def relations_between(self, first, last):
+        """ Return the list of (start, end, (o1, r, o2)) that overlap the
+            frames from `first` to `last`
+        """
+        starts, ends = self.tree.starts, self.tree.ends
+        return [(int(starts[i]), int(ends[i]), self.triplets[i]) for i in self.tree.overlap(first, last)]
+# End of RelationIndex class
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='input_file', help='Compressed file')
+    parser.add_argument('first', metavar='frame', help='Frame to query (or initial frame of a range)', type=int)
+    parser.add_argument('last', metavar='final_frame', help='Final frame of a range', type=int, nargs='?', default=None)
+    args = parser.parse_args()
+
+    index = RelationIndex(args.input)
+    if args.last is None:
+        for o1, r, o2 in index.relations_at(args.first):
+            print('{}\t{}\t{}\t{}'.format(args.first, o1, r, o2))
+    else:
+        for start, end, (o1, r, o2) in index.relations_between(args.first, args.last):
+            print('{}-{}\t{}\t{}\t{}'.format(start, end, o1, r, o2))
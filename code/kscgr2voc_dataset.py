@@ -40,10 +40,45 @@ import os
 import sys
 import shutil
 import argparse
-from os.path import splitext, basename, isdir, join, dirname
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+from os.path import splitext, basename, isdir, join, dirname, lexists, abspath
 
-def main(kscgrfile, vocfolder):
-    """ Convert KSCGR folder format to VOC format """
+import mapstore
+import progressbar as pbar
+
+LINK_MODES = ['hard', 'sym', 'copy']
+
+
+def link_file(task):
+    """ Create `pathout` as a hard link, a symbolic link or a copy of
+        `path` according to `mode` (executed by threads). Links that
+        cannot be created (e.g., hard links across filesystems) fall back
+        to copies.
+
+        Output: mode used to create `pathout`
+    """
+    path, pathout, mode = task
+    # never write through a link of a previous build
+    if lexists(pathout):
+        os.remove(pathout)
+    try:
+        if mode == 'hard':
+            os.link(path, pathout)
+            return mode
+        elif mode == 'sym':
+            os.symlink(abspath(path), pathout)
+            return mode
+    except OSError:
+        pass
+    shutil.copy2(path, pathout)
+    return 'copy'
+
+
+def main(kscgrfile, vocfolder, link='copy', nb_workers=8):
+    """ Convert KSCGR folder format to VOC format. Images are linked
+        or copied (see `link_file`) by `nb_workers` threads.
+    """
     if isdir(vocfolder):
         folderout = join(vocfolder, 'JPEGImages')
         if not isdir(folderout):
@@ -52,22 +87,35 @@ def main(kscgrfile, vocfolder):
         logger.error("'%s' is not a valid folder" % vocfolder)
         sys.exit(0)
     fout_paths = join(vocfolder, 'paths.txt')
-    fout_map = join(dirname(kscgrfile), 'map_paths.txt')
+    file_map = join(dirname(kscgrfile), 'map_paths.txt')
+    tasks = []
     with open(kscgrfile) as fin, \
          open(fout_paths, 'w') as fout, \
-         open(fout_map, 'w') as fout_map:
+         open(file_map, 'w') as fout_map:
         for i, line in enumerate(fin, start=1):
             path = line.strip().split()[0]
             namefile, ext = splitext(basename(path))
             fname = str(i).zfill(6)
             pathout = join(folderout, fname+'.jpg')
             fout.write('%s\n' % pathout)
-            shutil.copy2(path, pathout)
+            tasks.append((path, pathout, link))
             fout_map.write('%s : %s\n' % (path, pathout))
             if namefile == '0':
                 logger.info('Renaming: %s -> %s' % (path, pathout))
-    logger.info('All files copied into %s' % folderout)
-    logger.info('Saved map_paths.txt at: %s' % fout_map)
+
+    modes = Counter()
+    pb = pbar.ProgressBar(len(tasks))
+    pool = ThreadPool(nb_workers)
+    for mode in pool.imap_unordered(link_file, tasks, chunksize=64):
+        modes[mode] += 1
+        pb.update()
+    pool.close()
+    pool.join()
+    if link != 'copy' and modes['copy']:
+        logger.warning('%d files could not be linked and were copied' % modes['copy'])
+    logger.info('All files %s into %s' % ('copied' if link == 'copy' else 'linked', folderout))
+    logger.info('Saved map_paths.txt at: %s' % file_map)
+    mapstore.build_store(splitext(file_map)[0]+'.db', [(path, pathout) for path, pathout, _ in tasks])
     logger.info('Saved paths.txt at: %s' % fout_paths)
 
 
@@ -75,6 +123,7 @@ if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
     argparser.add_argument('inputfile', metavar='input', help='Path to the file containing paths of the KSCGR dataset.')
     argparser.add_argument('vocfolder', metavar='voc', help='Path to the folder where images are recorded.')
+    argparser.add_argument('-l', '--link', help='Create hard links, symbolic links or copies of images (default: copy). Links fall back to copies when not possible.', choices=LINK_MODES, default='copy')
+    argparser.add_argument('-w', '--workers', help='Number of threads linking or copying images', type=int, default=8)
     args = argparser.parse_args()
-    main(args.inputfile, args.vocfolder)
-
+    main(args.inputfile, args.vocfolder, args.link, args.workers)
@@ -41,6 +41,7 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import os
 import argparse
 from os.path import join, isdir, splitext, basename
+from multiprocessing import Pool
 from lxml import etree as ET
 from PIL import Image
 
@@ -48,35 +49,73 @@ import progressbar as pbar
 import filehandler as fh
 
 
-def main(inputfile, folderout):
+def iterate_frames(flis):
+    """ Yield (path_to_img, [(object, x, y, w, h), ...]) for each frame """
+    last_id = None
+    for _ in flis:
+        idf = flis.id()
+        if idf != last_id:
+            if last_id is not None:
+                yield fname, objs
+            last_id, fname, objs = idf, flis.fname, []
+        objs.append((flis.obj, flis.x, flis.y, flis.w, flis.h))
+    if last_id is not None:
+        yield fname, objs
+
+
+def iterate_batches(flis, batch_size):
+    """ Group frames of `flis` in lists containing `batch_size` frames """
+    batch = []
+    for frame in iterate_frames(flis):
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def save_batch(task):
+    """ Save the XML of each frame of a batch (executed by workers) """
+    batch, folderout, voc_class = task
+    nb_objects = 0
+    for fname, objs in batch:
+        xml = voc_class(fname, width=256, height=256)
+        for obj, x, y, w, h in objs:
+            xml.add_object(obj, x, y, w, h)
+        xml.save_xml(folderout)
+        nb_objects += len(objs)
+    return nb_objects
+
+
+def main(inputfile, folderout, nb_workers=None, batch_size=1000, use_lxml=False):
+    """ Convert `inputfile` into XML files in `folderout`. XML files are
+        generated from templates (`fh.VOCTemplate`) unless `use_lxml` is
+        True, in which case the XML tree is built with lxml (`fh.VOCFile`).
+        Both generate the same files.
+    """
+    voc_class = fh.VOCFile if use_lxml else fh.VOCTemplate
     if not isdir(folderout):
         os.mkdir(folderout)
 
     fann = fh.LisFile(inputfile)
     pb = pbar.ProgressBar(fann.count_lines())
+    pool = Pool(nb_workers)
     with fann as flis:
-        last_id = -1
-        for v in flis:
-            idf = flis.id()
-            #0 \t object \t (52,104,52,43) \t 0 \t data1/boild-egg/0.jpg 
-            if last_id == -1:
-                last_id = idf
-                xml = fh.VOCFile(flis.fname, width=256, height=256)
-                xml.add_object(flis.obj, flis.x, flis.y, flis.w, flis.h)
-            elif idf != last_id:
-                last_id = idf
-                xml.save_xml(folderout)
-                xml = fh.VOCFile(flis.fname, width=256, height=256)
-                xml.add_object(flis.obj, flis.x, flis.y, flis.w, flis.h)
-            else:
-                xml.add_object(flis.obj, flis.x, flis.y, flis.w, flis.h)
-            pb.update()
-        xml.save_xml(folderout)
+        #0 \t object \t (52,104,52,43) \t 0 \t data1/boild-egg/0.jpg 
+        tasks = ((batch, folderout, voc_class) for batch in iterate_batches(flis, batch_size))
+        for nb_objects in pool.imap_unordered(save_batch, tasks):
+            pb.update(nb_objects)
+    pool.close()
+    pool.join()
         
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('inputfile', metavar='file_input', help='File containing LIS annotation')
     parser.add_argument('output', metavar='folder_output', help='Folder to save the VOC annotation')
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
+    parser.add_argument('-b', '--batch_size', help='Number of frames sent to each worker at once', type=int, default=1000)
+    parser.add_argument('-x', '--lxml', help='Build the XML tree with lxml instead of templates', action='store_true')
     args = parser.parse_args()
-    main(args.inputfile, args.output)
+    main(args.inputfile, args.output, args.workers, args.batch_size, args.lxml)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Persistent mapping between KSCGR and VOC paths. The mapping file
+(`map_paths.txt`) generated by `kscgr2voc_dataset.py` contains lines as:
+
+/home/roger/KSCGR/data1/boild-egg/0.jpg : /home/roger/VOC/JPEGImages/000001.jpg
+
+and is stored in a SQLite database (`map_paths.db`) where each image is
+a row (voc_id, root, data, recipe, frame), i.e., the line above becomes:
+
+(1, 0, 'data1', 'boild-egg', 0)
+
+where `root` is the id of '/home/roger/KSCGR'. Rows are indexed both by
+`voc_id` and by (data, recipe, frame), and full paths are rebuilt from the
+roots of KSCGR paths and from the folder of VOC images. Thus, KSCGR paths
+are translated independently of their root folder.
+"""
+import argparse
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import os
+import sys
+import sqlite3
+from os.path import exists, getmtime, splitext, join
+
+import filehandler as fh
+
+SCHEMA = [
+    'CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE roots (id INTEGER PRIMARY KEY, path TEXT UNIQUE)',
+    'CREATE TABLE paths (voc_id INTEGER PRIMARY KEY, root INTEGER, data TEXT, recipe TEXT, frame INTEGER)',
+    'CREATE UNIQUE INDEX kscgr_key ON paths (data, recipe, frame)',
+]
+
+
+def split_kscgr(path):
+    """ Return (root, data, recipe, frame, ext) of a KSCGR path in the
+        form `root/data/recipe/frame.ext`
+    """
+    folder, fname = os.path.split(path)
+    folder, recipe = os.path.split(folder)
+    root, data = os.path.split(folder)
+    frame, ext = splitext(fname)
+    return root, data, recipe, int(frame), ext
+
+
+def split_voc(path):
+    """ Return (folder, voc_id, ext) of a VOC path in the form
+        `folder/000001.ext`
+    """
+    folder, fname = os.path.split(path)
+    voc_id, ext = splitext(fname)
+    return folder, int(voc_id), ext
+
+
+class MapStore(object):
+    """ Read the mapping stored in `dbfile` (see `build_store`) """
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.text_factory = str
+        meta = dict(self.conn.execute('SELECT name, value FROM meta'))
+        self.voc_folder = meta['voc_folder']
+        self.voc_ext = meta['voc_ext']
+        self.kscgr_ext = meta['kscgr_ext']
+        self.roots = dict(self.conn.execute('SELECT id, path FROM roots'))
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM paths').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def voc_path(self, voc_id):
+        return join(self.voc_folder, str(voc_id).zfill(6)+self.voc_ext)
+
+    def kscgr_path(self, root, data, recipe, frame):
+        return join(self.roots[root], data, recipe, str(frame)+self.kscgr_ext)
+
+    def voc_ids(self, keys):
+        """ Return the list of VOC ids of `keys` as (data, recipe, frame).
+            Keys that are not in the mapping receive None.
+        """
+        cur = self.conn.cursor()
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS query_keys '
+                    '(pos INTEGER PRIMARY KEY, data TEXT, recipe TEXT, frame INTEGER)')
+        cur.execute('DELETE FROM query_keys')
+        cur.executemany('INSERT INTO query_keys VALUES (?, ?, ?, ?)',
+                        ((pos, data, recipe, frame) for pos, (data, recipe, frame) in enumerate(keys)))
+        cur.execute('SELECT p.voc_id FROM query_keys q LEFT JOIN paths p '
+                    'ON p.data = q.data AND p.recipe = q.recipe AND p.frame = q.frame '
+                    'ORDER BY q.pos')
+        return [row[0] for row in cur]
+
+    def kscgr_keys(self, voc_ids):
+        """ Return the list of (root, data, recipe, frame) of `voc_ids`.
+            Ids that are not in the mapping receive None.
+        """
+        cur = self.conn.cursor()
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS query_ids (pos INTEGER PRIMARY KEY, voc_id INTEGER)')
+        cur.execute('DELETE FROM query_ids')
+        cur.executemany('INSERT INTO query_ids VALUES (?, ?)', enumerate(voc_ids))
+        cur.execute('SELECT p.root, p.data, p.recipe, p.frame FROM query_ids q '
+                    'LEFT JOIN paths p ON p.voc_id = q.voc_id ORDER BY q.pos')
+        return [row if row[1] is not None else None for row in cur]
+
+    def voc_paths(self, kscgr_paths):
+        """ Translate a list of KSCGR paths into VOC paths (None when the
+            path is not in the mapping)
+        """
+        keys = [split_kscgr(path)[1:4] for path in kscgr_paths]
+        return [self.voc_path(voc_id) if voc_id is not None else None for voc_id in self.voc_ids(keys)]
+
+    def kscgr_paths(self, voc_paths):
+        """ Translate a list of VOC paths into KSCGR paths (None when the
+            path is not in the mapping)
+        """
+        ids = [split_voc(path)[1] for path in voc_paths]
+        return [self.kscgr_path(*key) if key is not None else None for key in self.kscgr_keys(ids)]
+
+    def iterate(self):
+        """ Yield (voc_id, data, recipe, frame) sorted by voc_id """
+        for row in self.conn.execute('SELECT voc_id, data, recipe, frame FROM paths ORDER BY voc_id'):
+            yield row
+# End of MapStore class
+
+
+def build_store(dbfile, pairs):
+    """ Build the database `dbfile` from the pairs (kscgr_path, voc_path).
+        The database is written in a temporary file and renamed at the end.
+    """
+    partfile = dbfile+'.part'
+    if exists(partfile):
+        os.remove(partfile)
+    conn = sqlite3.connect(partfile)
+    conn.text_factory = str
+    for sql in SCHEMA:
+        conn.execute(sql)
+
+    droots = {}
+    meta = {}
+    def rows():
+        for kscgr, voc in pairs:
+            root, data, recipe, frame, kscgr_ext = split_kscgr(kscgr)
+            voc_folder, voc_id, voc_ext = split_voc(voc)
+            for name, value in (('kscgr_ext', kscgr_ext), ('voc_folder', voc_folder), ('voc_ext', voc_ext)):
+                if meta.setdefault(name, value) != value:
+                    logger.error('Paths with different {}: {} and {}'.format(name, meta[name], value))
+                    sys.exit()
+            if root not in droots:
+                droots[root] = len(droots)
+            yield voc_id, droots[root], data, recipe, frame
+    try:
+        conn.executemany('INSERT INTO paths VALUES (?, ?, ?, ?, ?)', rows())
+    except sqlite3.IntegrityError as err:
+        logger.error('Duplicated path in mapping: {}'.format(err))
+        sys.exit()
+    conn.executemany('INSERT INTO roots VALUES (?, ?)', [(id, root) for root, id in droots.items()])
+    meta.setdefault('kscgr_ext', '.jpg')
+    meta.setdefault('voc_folder', '')
+    meta.setdefault('voc_ext', '.jpg')
+    conn.executemany('INSERT INTO meta VALUES (?, ?)', meta.items())
+    conn.commit()
+    conn.close()
+    os.rename(partfile, dbfile)
+    logger.info('Saved mapping store at: {}'.format(dbfile))
+    return dbfile
+
+
+def load_store(map_file):
+    """ Open the mapping store of `map_file`. When `map_file` is a
+        `map_paths.txt` file, the store `map_paths.db` is (re)built when it
+        does not exist or when it is older than `map_file`.
+    """
+    if splitext(map_file)[1] == '.db':
+        fh.MapFile(map_file).exist_file()
+        return MapStore(map_file)
+    dbfile = splitext(map_file)[0]+'.db'
+    if not exists(dbfile) or (exists(map_file) and getmtime(dbfile) < getmtime(map_file)):
+        with fh.MapFile(map_file) as fmap:
+            build_store(dbfile, fmap)
+    return MapStore(dbfile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('map_file', metavar='map_paths', help='Path to the file containing the mapping between KSCGR and VOC.')
+    args = parser.parse_args()
+    with load_store(args.map_file) as store:
+        logger.info('Mapping store contains {} paths'.format(len(store)))
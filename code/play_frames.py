@@ -10,26 +10,83 @@ path_to_image.jpg xmin,ymin,xmax,ymax,class xmin,ymin,xmax,ymax,class xmin,ymin,
 
 Where xmin, ymin, xmax and ymax refer to the bounding box position that will be drawn. Class
 represents the bounding box color.
+
+Keys during playback:
+
+    Space        pause / resume
+    Right, Left  next / previous frame
+    Up, Down     jump forward / backward (see `--jump`)
+    Home, End    first / last frame
+
+and the name of a frame can be typed in the field at the top to seek it.
 """ 
 
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import os
 from os.path import join, splitext, basename
 from os.path import realpath
 
 import argparse
+import threading
+import time
+from collections import OrderedDict
 # Python 2
-from Tkinter import Tk, Label, Listbox, END, N, S, W
+from Tkinter import Tk, Label, Listbox, Entry, END, N, S, W, E
 # Python 3
-#from tkinter import Tk, Label, Listbox, END, N, S, W
+#from tkinter import Tk, Label, Listbox, Entry, END, N, S, W, E
 from PIL import Image, ImageTk, ImageDraw
-import ast
+import numpy as np
 from matplotlib import colors
 
+
+def load_index(input):
+    """
+    Read the input file into an index of frames
+
+    Parameters:
+    -----------
+    input : string
+        path to the input file
+
+    Output: (paths, boxes, offsets) where `boxes` is an array with rows
+        (xmin, ymin, xmax, ymax, class) and the boxes of the i-th frame
+        are `boxes[offsets[i]:offsets[i+1]]`. Coordinates may be floats
+        and malformed boxes (without 5 numbers) are skipped with a warning.
+    """
+    paths, boxes, counts = [], [], []
+    with open(input) as fin:
+        for nb_line, line in enumerate(fin, start=1):
+            arr = line.strip().split()
+            if not arr: continue
+            paths.append(arr[0])
+            counts.append(0)
+            for pos_label in arr[1:]:
+                #xmin, ymin, xmax, ymax, class_id = pos_label
+                values = pos_label.strip('()').split(',')
+                try:
+                    box = [float(v) for v in values]
+                except ValueError:
+                    box = None
+                if box is None or len(box) != 5:
+                    logger.warning('Skipping malformed box at line %d: %s' % (nb_line, pos_label))
+                    continue
+                boxes.append(box)
+                counts[-1] += 1
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 5)
+    return paths, boxes, offsets
+
+
 class ImageManager(object):
     """
-    Class to manage the frames
+    Class to manage the frames. Frames are decoded and annotated lazily and
+    kept in a LRU cache, which is filled by a background thread with the
+    frames ahead of the current position.
     """
-    def __init__(self, input):
+    def __init__(self, input, cache_size=64, prefetch=16):
         """
         Initiates the class ImageManager
     
@@ -38,13 +95,31 @@ class ImageManager(object):
         input : string
             path to the input file containing the paths to the images
             as well as the true values and the predicted values
+        cache_size : int
+            maximum number of annotated frames kept in memory
+        prefetch : int
+            number of frames loaded ahead of the current frame
         """
         self.input = realpath(input)
-        self.imgdata = []
+        self.paths = []
+        self.names = None
         self.index = 0
+        self.seeks = 0
         self.width = 0
         self.height = 0
+        self.cache_size = max(cache_size, prefetch+1)
+        self.prefetch = prefetch
+        self.cache = OrderedDict()
+        self.colors = list(colors.cnames.keys())
+        self.lock = threading.Lock()
+        self.moved = threading.Condition(self.lock)
+        self.running = True
         self._loadImages()
+        if self.paths:
+            self._check_size(self.paths[0])
+        self.thread = threading.Thread(target=self._prefetch)
+        self.thread.daemon = True
+        self.thread.start()
 
 
     def __iter__(self):
@@ -52,50 +127,158 @@ class ImageManager(object):
         Iterates over the images yielding the path of the image,
         the name of the image, the true label and the predicted label.
         """
-        for path, name in self.imgdata:
-            yield path, name
+        for i, path in enumerate(self.paths):
+            yield path, self.positions(i)
+
+
+    def __len__(self):
+        return len(self.paths)
 
     
     def _check_size(self, pathimg):
-        """Check the size of an image"""
+        """Check the size of an image (only the header is read)"""
         im = Image.open(pathimg)
         self.width, self.height = im.size
 
 
     def _loadImages(self):
         """
-        Extract the content from the file and stores into an array.
+        Extract the content from the file and stores into arrays (see
+        `load_index`). Images are not opened (see `frame`).
         """
-        self.imgdata = []
-        with open(self.input) as fin:
-            for line in fin:
-                arr = line.strip().split()
-                path = arr[0]
-                positions = []
-                for i, pos_label in enumerate(arr[1:]):
-                    pos_label = ast.literal_eval(pos_label)
-                    #xmin, ymin, xmax, ymax, class_id = pos_label
-                    positions.append(pos_label)
-                self.imgdata.append((path, positions))
-                self._check_size(path)
-        return self.imgdata
+        self.paths, self.boxes, self.offsets = load_index(self.input)
+        return self.paths
 
 
-    def nextImage(self):
+    def positions(self, index):
         """
-        Return the path, true label and predicted label of the next image 
-        in the list of images.
+        Return the list of (xmin, ymin, xmax, ymax, class) of the frame `index`
+        """
+        return self.boxes[self.offsets[index]:self.offsets[index+1]].tolist()
+
+
+    def find(self, name):
         """
-        path, positions = self.imgdata[self.index]
+        Return the index of the frame named `name` (e.g. '120' for 120.jpg)
+        or None when the frame does not exist
+        """
+        if self.names is None:
+            self.names = dict([(splitext(basename(path))[0], i) for i, path in enumerate(self.paths)])
+        return self.names.get(name)
+
+
+    def _render(self, index):
+        """
+        Open the image of the frame `index` and draw its bounding boxes
+        """
+        path = self.paths[index]
+        positions = self.positions(index)
         name, _ = splitext(basename(path))
-        if self.index < len(self.imgdata)-1:
-            self.index += 1
-        
         im = Image.open(path)
+        im.load()
         draw = ImageDraw.Draw(im)
         for xmin, ymin, xmax, ymax, class_id in positions:
-            cname = colors.cnames.keys()[class_id]
-            draw.rectangle(((xmin, ymin), (xmax, ymax)), outline=cname)
+            cname = self.colors[int(class_id)]
+            # inverted boxes are drawn with their corners swapped
+            draw.rectangle(((min(xmin, xmax), min(ymin, ymax)), (max(xmin, xmax), max(ymin, ymax))), outline=cname)
+        return name, im
+
+
+    def _store(self, index, frame):
+        """
+        Add a frame to the cache removing the least recently used frames.
+        Frames ahead of the current position (see `_ahead`) are never
+        removed, otherwise they would be decoded again before being shown.
+        """
+        with self.lock:
+            self.cache[index] = frame
+            start, end = self.index, self.index+self.prefetch
+            for i in list(self.cache):
+                if len(self.cache) <= self.cache_size:
+                    break
+                if not start <= i < end:
+                    del self.cache[i]
+
+
+    def _prefetch(self):
+        """
+        Load the frames ahead of the current frame (executed by a thread)
+        """
+        while True:
+            with self.lock:
+                while self.running and all(i in self.cache for i in self._ahead()):
+                    self.moved.wait()
+                if not self.running:
+                    return
+                missing = [i for i in self._ahead() if i not in self.cache]
+                seeks = self.seeks
+            for index in missing:
+                if index < self.index or seeks != self.seeks:
+                    # the position moved while prefetching
+                    break
+                try:
+                    self._store(index, self._render(index))
+                except (IOError, OSError):
+                    # unreadable images are reported by `frame`
+                    self._store(index, None)
+
+
+    def _ahead(self):
+        return range(self.index, min(self.index+self.prefetch, len(self.paths)))
+
+
+    def frame(self, index):
+        """
+        Return the name and the annotated image of the frame `index`
+        """
+        with self.lock:
+            frame = self.cache.pop(index, None)
+            if frame is not None:
+                self.cache[index] = frame
+        if frame is None:
+            frame = self._render(index)
+            self._store(index, frame)
+        return frame
+
+
+    def stop(self):
+        """
+        Stop the prefetching thread
+        """
+        with self.lock:
+            self.running = False
+            self.moved.notify()
+
+
+    def seek(self, index):
+        """
+        Move the current position to the frame `index`
+        """
+        with self.lock:
+            self.index = min(max(index, 0), len(self.paths)-1)
+            self.seeks += 1
+            self.moved.notify()
+        return self.index
+
+
+    def jump(self, nb_frames):
+        """
+        Move the current position `nb_frames` forward (or backward when
+        negative)
+        """
+        return self.seek(self.index+nb_frames)
+
+
+    def nextImage(self):
+        """
+        Return the path, true label and predicted label of the next image 
+        in the list of images.
+        """
+        name, im = self.frame(self.index)
+        with self.lock:
+            if self.index < len(self.paths)-1:
+                self.index += 1
+            self.moved.notify()
         return name, im
 #End of class ImageManager
 
@@ -104,28 +287,77 @@ class DemoWindow(Tk):
     """
     Class to manage the window of the demo
     """
-    def __init__(self, fileinput):
+    def __init__(self, fileinput, cache_size=64, prefetch=16, fps=None, jump=100, start=None):
         """
         Build the visual interface with images and fields to the images data
+
+        Parameters:
+        -----------
+        fps : float (optional)
+            target frame rate. Frames are dropped when they cannot be
+            shown in time. Frames are shown as fast as possible when
+            `fps` is not informed.
+        jump : int
+            number of frames skipped with the Up and Down keys
+        start : string (optional)
+            name of the first frame
         """
         fileinput = realpath(fileinput)
-        self.imgs = ImageManager(fileinput)
+        self.imgs = ImageManager(fileinput, cache_size, prefetch)
         Tk.__init__(self)
         self.title("Frame sequence")
         # width x height + x_offset + y_offset:
         self.geometry(str(self.imgs.width+20)+"x"+str(self.imgs.height+30)+"+1+1")
         self.i = 0
         self.prev = 0
+        self.fps = fps
+        self.step = jump
+        self.paused = False
+        self.dropped = 0
 
         self.frame = Label(self, text="")
         self.frame.grid(row=0, column=1, padx=10, pady=2, sticky=N+S+W)
 
+        self.entry = Entry(self, width=8)
+        self.entry.grid(row=0, column=1, padx=10, pady=2, sticky=N+S+E)
+        self.entry.bind('<Return>', self.seek_entry)
+
         self.image = Label(self, image=None)
         self.image.grid(row=1, column=1, padx=10, pady=2, sticky=N+S+W)
 
+        self.bind('<space>', self._playback_key(self.toggle_pause))
+        self.bind('<Right>', self._playback_key(lambda: self.move(1)))
+        self.bind('<Left>', self._playback_key(lambda: self.move(-1)))
+        self.bind('<Up>', self._playback_key(lambda: self.move(self.step)))
+        self.bind('<Down>', self._playback_key(lambda: self.move(-self.step)))
+        self.bind('<Home>', self._playback_key(lambda: self.move_to(0)))
+        self.bind('<End>', self._playback_key(lambda: self.move_to(len(self.imgs)-1)))
+
+        if start is not None:
+            self.move_to(self.imgs.find(start) or 0)
+        self._reset_clock()
         self.update_window()
 
 
+    def _playback_key(self, action):
+        """
+        Return a key handler calling `action`, except for keys typed in the
+        entry field (where space and arrows edit the name of the frame)
+        """
+        def handler(event):
+            if event.widget is not self.entry:
+                action()
+        return handler
+
+
+    def _reset_clock(self):
+        """
+        Restart the clock of the frame rate from the current frame
+        """
+        self.start_time = time.time()
+        self.start_index = self.imgs.index
+
+
     def updateImage(self, img):
         """
         Update the Label containing the image
@@ -138,17 +370,80 @@ class DemoWindow(Tk):
         """
         Update the label containing the number of the frame
         """
+        if self.paused:
+            text += ' (paused)'
+        elif self.dropped:
+            text += ' (dropped: %d)' % self.dropped
         self.frame.configure(text='Frame: '+text)
 
 
-    def update_window(self):
+    def show_current(self):
         """
-        Update the window and its elements every second
+        Show the frame of the current position without advancing
         """
-        name, fimg = self.imgs.nextImage()
+        name, fimg = self.imgs.frame(self.imgs.index)
         self.updateImage(fimg)
         self.updateLabelFrame(name)
-        self.after(1, self.update_window)
+
+
+    def move_to(self, index):
+        """
+        Seek the frame `index`
+        """
+        self.imgs.seek(index)
+        self._reset_clock()
+        if self.paused:
+            self.show_current()
+
+
+    def move(self, nb_frames):
+        """
+        Jump `nb_frames` forward (or backward)
+        """
+        self.move_to(self.imgs.index+nb_frames)
+
+
+    def seek_entry(self, event=None):
+        """
+        Seek the frame typed in the entry field
+        """
+        index = self.imgs.find(self.entry.get().strip())
+        if index is None:
+            self.frame.configure(text='Frame not found: '+self.entry.get().strip())
+        else:
+            self.move_to(index)
+        self.focus_set()
+
+
+    def toggle_pause(self, event=None):
+        """
+        Pause or resume the playback
+        """
+        self.paused = not self.paused
+        self._reset_clock()
+        if self.paused:
+            self.show_current()
+
+
+    def update_window(self):
+        """
+        Update the window and its elements according to the frame rate
+        """
+        delay = 1
+        if not self.paused:
+            if self.fps:
+                # drop frames when the playback is late
+                expected = self.start_index+int((time.time()-self.start_time)*self.fps)
+                if expected > self.imgs.index:
+                    self.dropped += min(expected, len(self.imgs)-1)-self.imgs.index
+                    self.imgs.seek(expected)
+            name, fimg = self.imgs.nextImage()
+            self.updateImage(fimg)
+            self.updateLabelFrame(name)
+            if self.fps:
+                shown = self.imgs.index-self.start_index
+                delay = max(1, int(1000*(self.start_time+shown/float(self.fps)-time.time())))
+        self.after(delay, self.update_window)
 #End of class DemoWindow
 
 
@@ -157,8 +452,18 @@ if __name__== "__main__":
 
     parser.add_argument('inputfile', metavar='file_input', 
                         help='file or folder containing images.')
+    parser.add_argument('-c', '--cache_size', type=int, default=64,
+                        help='maximum number of frames kept in memory.')
+    parser.add_argument('-p', '--prefetch', type=int, default=16,
+                        help='number of frames loaded ahead of the current frame.')
+    parser.add_argument('-f', '--fps', type=float, default=None,
+                        help='target frame rate (frames are dropped when late).')
+    parser.add_argument('-j', '--jump', type=int, default=100,
+                        help='number of frames skipped with the Up and Down keys.')
+    parser.add_argument('-s', '--start', default=None,
+                        help='name of the first frame (e.g. 120 for 120.jpg).')
     args = parser.parse_args()
     
-    window = DemoWindow(args.inputfile)
+    window = DemoWindow(args.inputfile, args.cache_size, args.prefetch, args.fps, args.jump, args.start)
     window.mainloop()
-    
+    window.imgs.stop()
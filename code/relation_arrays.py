@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Columnar representation of Decompressed files. Each relation
+(Subject, Relation, Object) is interned into an integer id, so that
+a file containing:
+
+0\tperson\tholding\tshell-egg
+1\tperson\tholding\tshell-egg
+1\tperson\tmoving\tshell-egg
+2\tshell-egg\ton\tbowl
+
+is loaded as the arrays:
+
+frames   = [0, 1, 1, 2]
+triplets = [0, 0, 1, 2]
+
+and CSR-style offsets of frames, i.e., relations of the i-th frame
+(with id `idframes[i]`) are `triplets[offsets[i]:offsets[i+1]]`:
+
+idframes = [0, 1, 2]
+offsets  = [0, 1, 3, 4]
+
+Frames containing `None` relations have no triplets.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import hashlib
+from os.path import exists, splitext
+
+import numpy as np
+
+import filehandler as fh
+
+
+class Vocabulary(object):
+    """ Vocabulary of triplets built on the fly, i.e., triplets receive
+        ids in the order they appear.
+    """
+    def __init__(self):
+        self.triplet2id = {}
+        self.triplets = []
+
+    def __len__(self):
+        return len(self.triplets)
+
+    def encode(self, sub, rel, obj):
+        """ Return the id of the triplet (sub, rel, obj) """
+        key = (sub, rel, obj)
+        try:
+            return self.triplet2id[key]
+        except KeyError:
+            idt = self.triplet2id[key] = self._new_id(key)
+            return idt
+
+    def _new_id(self, key):
+        self.triplets.append(key)
+        return len(self.triplets)-1
+
+    def decode(self, idt):
+        """ Return the triplet (sub, rel, obj) of the id `idt` """
+        return self.triplets[idt]
+
+    def rank(self, ids):
+        """ Return the position of each id of `ids` when their triplets
+            are sorted by name.
+        """
+        ids = np.asarray(ids)
+        uniq, inv = np.unique(ids, return_inverse=True)
+        names = [self.decode(idt) for idt in uniq]
+        ranks = np.empty(len(uniq), dtype=np.int64)
+        ranks[sorted(range(len(uniq)), key=names.__getitem__)] = np.arange(len(uniq))
+        return ranks[inv]
+# End of Vocabulary class
+
+
+class ConfigVocabulary(Vocabulary):
+    """ Vocabulary of triplets built from configuration files for objects
+        and relations (see `filehandler.ConfigFile`). The id of a triplet
+        is the position of (id_subject, id_relation, id_object) in a dense
+        tensor with shape (nb_objects, nb_relations, nb_objects). Triplets
+        containing names that are not in the dictionaries receive negative
+        ids (-1, -2, ...).
+    """
+    def __init__(self, class_file='classes.cfg', rels_file='relations.cfg', do=None, dr=None):
+        super(ConfigVocabulary, self).__init__()
+        # dictionaries as {'name': id}
+        if do is None:
+            do = fh.ConfigFile(class_file).load_classes(cnames=True)
+        if dr is None:
+            dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+        self.do = do
+        self.dr = dr
+        self.unknown = []
+        self.ido = dict([(v, k) for k, v in do.items()])
+        self.idr = dict([(v, k) for k, v in dr.items()])
+        self.shape = (max(self.ido)+1, max(self.idr)+1, max(self.ido)+1)
+
+    def __len__(self):
+        return int(np.prod(self.shape))
+
+    def _new_id(self, key):
+        sub, rel, obj = key
+        if sub not in self.do or rel not in self.dr or obj not in self.do:
+            logger.warning('Triplet not found in dictionaries: {}'.format(key))
+            self.unknown.append(key)
+            return -len(self.unknown)
+        return int(np.ravel_multi_index((self.do[sub], self.dr[rel], self.do[obj]), self.shape))
+
+    def decode(self, idt):
+        if idt < 0:
+            return self.unknown[-idt-1]
+        sub, rel, obj = self.split(idt)
+        return self.ido[int(sub)], self.idr[int(rel)], self.ido[int(obj)]
+
+    def split(self, ids):
+        """ Return the arrays of ids of subjects, relations and objects """
+        return np.unravel_index(ids, self.shape)
+# End of ConfigVocabulary class
+
+
+class RelationArrays(object):
+    """ Relations of a Decompressed file stored as integer arrays. Arrays
+        `lines` and `frame_lines` contain the number of the line in the file
+        for each relation and for the first line of each frame.
+    """
+    def __init__(self, frames, triplets, idframes, offsets, vocab, path='', lines=None, frame_lines=None):
+        self.frames = frames
+        self.triplets = triplets
+        self.idframes = idframes
+        self.offsets = offsets
+        self.lines = lines
+        self.frame_lines = frame_lines
+        self.vocab = vocab
+        self.path = path
+
+    def __len__(self):
+        return len(self.triplets)
+
+    def nb_frames(self):
+        return len(self.idframes)
+
+    def frame(self, i):
+        """ Return the array of triplets of the i-th frame """
+        return self.triplets[self.offsets[i]:self.offsets[i+1]]
+
+    def iterate_frames(self):
+        """ Yield the id of the frame and its list of triplets as
+            `DecompressedFile.iterate_frames`
+        """
+        decode = self.vocab.decode
+        for i, idfr in enumerate(self.idframes):
+            yield idfr, [decode(idt) for idt in self.frame(i)]
+# End of RelationArrays class
+
+
+def load_decompressed(inputfile, vocab=None):
+    """ Load a Decompressed file sorted by frames as a `RelationArrays`.
+
+        Parameters:
+        -----------
+        inputfile: string
+            path to the Decompressed file
+        vocab: Vocabulary (optional)
+            vocabulary to intern triplets. A new vocabulary is created
+            if not informed, thus, share the same vocabulary to compare
+            ids of different files.
+    """
+    if vocab is None:
+        vocab = Vocabulary()
+    encode = vocab.encode
+    path = ''
+    frames, triplets, lines = [], [], []
+    idframes, counts, frame_lines = [], [], []
+    last_id = None
+    with open(inputfile) as fin:
+        for nb_line, line in enumerate(fin, start=1):
+            if not line or not line[0].isdigit():
+                if 'Path:' in line:
+                    path = line.strip().split('Path: ')[-1]
+                continue
+            arr = line.strip().split('\t')
+            if len(arr) < 4 or len(arr) > 5:
+                fh.error_line(nb_line, line)
+            idfr = int(arr[0])
+            if idfr != last_id:
+                idframes.append(idfr)
+                frame_lines.append(nb_line)
+                counts.append(0)
+                last_id = idfr
+            if arr[1] == 'None':
+                continue
+            frames.append(idfr)
+            triplets.append(encode(arr[1], arr[2], arr[3]))
+            lines.append(nb_line)
+            counts[-1] += 1
+
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return RelationArrays(np.array(frames, dtype=np.int64),
+                          np.array(triplets, dtype=np.int64),
+                          np.array(idframes, dtype=np.int64),
+                          offsets, vocab, path,
+                          np.array(lines, dtype=np.int64),
+                          np.array(frame_lines, dtype=np.int64))
+
+
+def compress_runs(rarr):
+    """ Extract the runs of contiguous frames of each triplet. Pairs of
+        (triplet, frame) are sorted once and a run finishes when the
+        triplet changes or when the difference between frames is not one.
+        Thus, duplicated (triplet, frame) pairs are not merged but start a
+        new run at the same frame as in `DecompressedFile.group_relations`,
+        e.g., frames [5, 6, 6, 7] of a triplet give the runs 5-6 and 6-7.
+
+        Output: (initial_frames, final_frames, triplets) sorted as in
+            Compressed files, i.e., by initial frame and name of triplets.
+    """
+    order = np.lexsort((rarr.frames, rarr.triplets))
+    triplets = rarr.triplets[order]
+    frames = rarr.frames[order]
+    if not len(frames):
+        return frames, frames, triplets
+
+    first = np.ones(len(frames), dtype=bool)
+    first[1:] = (np.diff(triplets) != 0) | (np.diff(frames) != 1)
+    idx_first = np.flatnonzero(first)
+    idx_last = np.append(idx_first[1:]-1, len(frames)-1)
+    starts = frames[idx_first]
+    ends = frames[idx_last]
+    triplets = triplets[idx_first]
+
+    order = np.lexsort((rarr.vocab.rank(triplets), starts))
+    return starts[order], ends[order], triplets[order]
+
+
+def possible_relations(config_file, vocab, cache=True):
+    """ Compile a file of possible relations containing lines as:
+
+            Subject Relation Object
+
+        into a boolean tensor with the shape of `vocab` (ConfigVocabulary),
+        i.e., `tensor[id_subject, id_relation, id_object]` is True for
+        possible relations. The tensor is cached in a `.npz` file next to
+        `config_file` and recompiled when the files of dictionaries or of
+        possible relations change.
+    """
+    signature = hashlib.md5()
+    with open(config_file, 'rb') as fin:
+        signature.update(fin.read())
+    signature.update(repr((sorted(vocab.do.items()), sorted(vocab.dr.items()))).encode('utf-8'))
+    signature = signature.hexdigest()
+
+    fcache = splitext(config_file)[0]+'.npz'
+    if cache and exists(fcache):
+        with np.load(fcache) as data:
+            if str(data['signature']) == signature and tuple(data['tensor'].shape) == vocab.shape:
+                return data['tensor']
+
+    tensor = np.zeros(vocab.shape, dtype=bool)
+    with open(config_file) as fin:
+        for line in fin:
+            arr = line.strip().split()
+            if not arr: continue
+            sub, rel, obj = arr
+            if sub not in vocab.do or rel not in vocab.dr or obj not in vocab.do:
+                logger.warning('Possible relation not found in dictionaries: {}'.format((sub, rel, obj)))
+                continue
+            tensor[vocab.do[sub], vocab.dr[rel], vocab.do[obj]] = True
+
+    if cache:
+        try:
+            np.savez(fcache, tensor=tensor, signature=signature)
+            logger.info('Saved compiled possible relations at: {}'.format(fcache))
+        except (IOError, OSError):
+            logger.warning('Could not save compiled possible relations at: {}'.format(fcache))
+    return tensor
+
+
+def check_possible(triplets, tensor):
+    """ Return a boolean array indicating which `triplets` (ids from a
+        ConfigVocabulary) are possible according to `tensor`
+    """
+    triplets = np.asarray(triplets)
+    return (triplets >= 0) & tensor.ravel()[np.maximum(triplets, 0)]
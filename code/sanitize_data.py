@@ -4,6 +4,11 @@
 This script first checks whether the sequence of frames is correct for
 bouding boxes and relations. Then, for a each relation it checks whether 
 exists bounding boxes in the image or not. 
+
+Using `--folder`, all pairs of `BBox - <recipe>.txt` and `Relations - <recipe>.txt`
+inside the folder (e.g. KSCGR/lis) are checked in parallel and all issues
+are saved in a single report. Sanitized files of relations are only saved
+when an output folder is informed with `--output`.
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -12,111 +17,253 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import sys
 import os
 import argparse
-from os.path import join, dirname, splitext, basename
-from collections import defaultdict
+from os.path import join, dirname, splitext, basename, isfile
+from multiprocessing import Pool
+import csv
+import json
+from itertools import chain
+from collections import defaultdict, Counter
+
+import numpy as np
 
 import filehandler as fh
+import relation_arrays as ra
+
+REPORT_FIELDS = ['file', 'frame', 'line', 'check', 'message']
+# frame and line of issues that concern the whole file
+NO_LINE = -1
+
+
+def new_issue(path, frame, line, check, message):
+    """ Structured description of a problem found in `path` """
+    return {'file': path, 'frame': frame, 'line': line, 'check': check, 'message': message}
 
 
-def check_error(objects, obj, path):
-    """ Check whether there is the object in the image """
-    if obj not in objects:
-        logger.error('Could not find element in frame: {} [IMAGE: {}]'.format(obj, path))
-        return False
-    return True
-
-
-def verify_sequence_frames(inputfile):
-    """ Verify whether the sequence of frames is increased by one """
-    logger.info('Checking sequence for file: {}'.format(inputfile))
-    with open(inputfile) as fin:
-        last_fr = 0
-        last_id = -1
-        for line in fin:
-            if not line[0].isdigit(): continue
-            fr = int(line.strip().split('\t')[0])
-            if fr != last_id and fr != 0:
-                if fr != (last_fr + 1):
-                    logger.error('Could not find a correct sequence. Uncorrect at frame: {}'.format(last_fr))
-                    sys.exit()
-                last_fr = fr
-            last_id = fr
-
-
-def load_possible_relations(config_file):
-    dic = {}
-    with open(config_file) as fin:
-        for line in fin:
-            sub, rel, obj = line.strip().split()
-            dic[(sub, rel, obj)] = ''
-    return dic
-
-
-def sanitize_for_bounding_boxes(file_objects, file_relations, output=None):
+def save_report(issues, output):
+    """ Save the list of issues as a JSON file (when `output` ends with
+        `.json`) or as a CSV file
+    """
+    with open(output, 'w') as fout:
+        if output.endswith('.json'):
+            json.dump(issues, fout, indent=1, sort_keys=True)
+        else:
+            writer = csv.DictWriter(fout, fieldnames=REPORT_FIELDS, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(issues)
+    logger.info('Saved report with {} issues at: {}'.format(len(issues), output))
+
+
+def check_sequence(frames, path, issues):
+    """ Pass through (id_frame, line, content) from `frames` adding an issue
+        when frames do not start at zero or are not increased by one
+    """
+    last_fr = -1
+    for idfr, nb_line, content in frames:
+        if idfr != last_fr + 1:
+            issues.append(new_issue(path, idfr, nb_line, 'sequence',
+                          'Could not find a correct sequence. Expected frame {}'.format(last_fr+1)))
+        last_fr = idfr
+        yield idfr, nb_line, content
+
+
+def object_frames(flis):
+    """ Yield (id_frame, line, set of objects) from an opened LisFile """
+    last_id = None
+    for _ in flis:
+        if flis.idfr != last_id:
+            if last_id is not None:
+                yield last_id, first_line, objects
+            last_id, first_line, objects = flis.idfr, flis.nb_line, set()
+        objects.add(flis.obj)
+    if last_id is not None:
+        yield last_id, first_line, objects
+
+
+def relation_frames(frels):
+    """ Yield (id_frame, line, [(line, o1, r, o2), ...]) from an opened DecompressedFile """
+    last_id = None
+    for arr in frels:
+        nb_line = frels.nb_line+1
+        if arr[0] != last_id:
+            if last_id is not None:
+                yield last_id, first_line, relations
+            last_id, first_line, relations = arr[0], nb_line, []
+        relations.append((nb_line, arr[1], arr[2], arr[3]))
+    if last_id is not None:
+        yield last_id, first_line, relations
+
+
+def sanitize_for_bounding_boxes(file_objects, file_relations, output=None, report=True, save=True):
     """ Check whether a file of relations is according with the bouding boxes
-        described in the `file_objects` file.
+        described in the `file_objects` file. Both files are read in a single
+        pass merging their frames, while the sequence of frames is checked.
+        Relations with their bounding boxes are saved in `output` unless
+        `save=False`.
+
+        Output: list of issues (see `new_issue`)
     """
     if not output:
         fname, ext = splitext(basename(file_relations))
         output = join(dirname(file_relations), fname+'_sanity'+ext)
+    fname, _ = splitext(output)
+    fileissues = fname+'_issues.csv'
+    if not save:
+        output = os.devnull
 
-    verify_sequence_frames(file_objects)
-    verify_sequence_frames(file_relations)
-
-    drels = defaultdict(list)
-    # Load groups of relations for frame 
-    frls = fh.DecompressedFile(file_relations)
-    with frls as frels:
-        for arr in frels:
-            fr, o1, r, o2 = arr[0], arr[1], arr[2], arr[3]
-            pathimg = str(fr)+'.jpg'
-            drels[pathimg].append((fr, o1, r, o2))
-    logger.info('Loaded relations for {} frames.'.format(len(drels)))
-
-    errors = 0
+    issues = []
     filelis = fh.LisFile(file_objects)
-    with open(output, 'w') as fout, filelis as flis:
+    frls = fh.DecompressedFile(file_relations)
+    with filelis as flis, frls as frels, open(output, 'w') as fout:
+        objects_iter = check_sequence(object_frames(flis), file_objects, issues)
+        relations_iter = check_sequence(relation_frames(frels), file_relations, issues)
+        idobj, _, objects = next(objects_iter, (None, 0, set()))
+        # path is read from the header with the first frame
+        first = next(relations_iter, None)
         fout.write('Frame\tSubject\tRelation\tObject\tPath: {}\n'.format(frls.path))
-        for pathimg, arr in flis.iterate_frames():
-            objects = [bbox[0] for bbox in arr]
-            relations = drels[pathimg]
-            for fr, o1, r, o2 in relations:
-                if check_error(objects, o1, pathimg) and check_error(objects, o2, pathimg):
-                    fout.write('{}\t{}\t{}\t{}\n'.format(fr, o1, r, o2))
+        for idfr, _, relations in chain([first] if first else [], relations_iter):
+            while idobj is not None and idobj < idfr:
+                idobj, _, objects = next(objects_iter, (None, 0, set()))
+            if idobj != idfr:
+                objects = set()
+            for nb_line, o1, r, o2 in relations:
+                missing = [obj for obj in (o1, o2) if obj not in objects and obj != 'None']
+                if missing:
+                    issues.append(new_issue(file_relations, idfr, nb_line, 'bounding_box',
+                                  'Could not find element in frame: {}'.format(', '.join(missing))))
                 else:
-                    errors += 1
-    if errors:
-        logger.info('Finished WITH {} errors!'.format(errors))
+                    fout.write('{}\t{}\t{}\t{}\n'.format(idfr, o1, r, o2))
+        # check the sequence of remaining frames
+        for _ in objects_iter: pass
+
+    if issues:
+        for check, nb in sorted(Counter(issue['check'] for issue in issues).items()):
+            logger.error('Found {} issues of {}'.format(nb, check))
+        if report:
+            save_report(issues, fileissues)
+        logger.info('Finished WITH {} errors!'.format(len(issues)))
     else:
-        os.remove(output)
+        if save:
+            os.remove(output)
         logger.info('Finished without errors!')
+    return issues
+
 
+def sequence_issues(rarr, path):
+    """ Issues for frames of a `RelationArrays` that do not start at zero
+        or are not increased by one
+    """
+    expected = np.append(0, rarr.idframes[:-1]+1)
+    return [new_issue(path, int(rarr.idframes[i]), int(rarr.frame_lines[i]), 'sequence',
+                      'Could not find a correct sequence. Expected frame {}'.format(expected[i]))
+            for i in np.flatnonzero(rarr.idframes != expected)]
 
-def sanitize_relations(file_relations, config_file):
+
+def sanitize_relations(file_relations, config_file, class_file='classes.cfg', rels_file='relations.cfg'):
     """ Check whether a file containing relations is according with the possible relations
-        described in the `config_file` file.
+        described in the `config_file` file. Each impossible relation is reported
+        at the first line it appears.
+
+        Output: list of issues (see `new_issue`)
     """
     logger.info('Checking file: {}'.format(file_relations))
-    verify_sequence_frames(file_relations)
-    drels = load_possible_relations(config_file)
+    vocab = ra.ConfigVocabulary(class_file, rels_file)
+    possible = ra.possible_relations(config_file, vocab)
+    rarr = ra.load_decompressed(file_relations, vocab)
+    issues = sequence_issues(rarr, file_relations)
 
-    # Load groups of relations for frame
-    errors = 0 
-    recorded = {}
-    frls = fh.DecompressedFile(file_relations)
-    with frls as frels:
-        for arr in frels:
-            fr, o1, r, o2 = arr[0], arr[1], arr[2], arr[3]
-            pathimg = str(fr)+'.jpg'
-            if not drels.has_key((o1, r, o2)) and not recorded.has_key((o1, r, o2)):
-                logger.error('There is not possible relation: [{}, {}, {}]'.format(o1, r, o2))
-                recorded[(o1, r, o2)] = ''
-                errors += 1
-
-    if errors:
-        logger.info('Finished WITH {} errors!'.format(errors))
+    # first line of each impossible relation
+    invalid = np.flatnonzero(~ra.check_possible(rarr.triplets, possible))
+    _, first = np.unique(rarr.triplets[invalid], return_index=True)
+    for i in np.sort(invalid[first]):
+        o1, r, o2 = vocab.decode(rarr.triplets[i])
+        logger.error('There is not possible relation: [{}, {}, {}]'.format(o1, r, o2))
+        issues.append(new_issue(file_relations, int(rarr.frames[i]), int(rarr.lines[i]), 'possible_relation',
+                      'There is not possible relation: [{}, {}, {}]'.format(o1, r, o2)))
+
+    if issues:
+        logger.info('Finished WITH {} errors!'.format(len(issues)))
     else:
         logger.info('Finished without errors!')
+    return issues
+
+
+def sanitize_pair(task):
+    """ Run all checks for a file of relations and its file of bounding
+        boxes (executed by workers). Errors of a check (including `sys.exit`
+        of malformed lines) are reported as issues of the file, thus, a bad
+        file does not stop the pool. Relations with their bounding boxes are
+        saved in `output` when it is informed.
+    """
+    file_objects, file_relations, output, config_file, class_file, rels_file = task
+    issues = []
+    try:
+        issues.extend(sanitize_relations(file_relations, config_file, class_file, rels_file))
+    except (Exception, SystemExit) as err:
+        issues.append(new_issue(file_relations, NO_LINE, NO_LINE, 'error',
+                      'Could not check possible relations: {!r}'.format(err)))
+    if not file_objects:
+        issues.append(new_issue(file_relations, NO_LINE, NO_LINE, 'bounding_box', 'Could not find file of bounding boxes'))
+        return issues
+    try:
+        issues.extend(sanitize_for_bounding_boxes(file_objects, file_relations, output, report=False, save=bool(output)))
+    except (Exception, SystemExit) as err:
+        if output and isfile(output):
+            os.remove(output)
+        issues.append(new_issue(file_relations, NO_LINE, NO_LINE, 'error',
+                      'Could not check bounding boxes in {}: {!r}'.format(file_objects, err)))
+    return issues
+
+
+def sanitize_folder(folder_input, config_file, report=None, nb_workers=None, class_file='classes.cfg', rels_file='relations.cfg', output=None):
+    """ Check all pairs of `BBox - <recipe>.txt` and `Relations - <recipe>.txt`
+        files inside `folder_input` (e.g. KSCGR/lis) in a pool of workers
+        and save all issues in `report` (JSON or CSV file, by default
+        `sanity_report.csv` in the `output` folder or in the current
+        directory). Files inside
+        `folder_input` are not modified: sanitized files of relations are
+        saved in the `output` folder (keeping the subfolders of the input)
+        only when it is informed.
+    """
+    if output and not os.path.isdir(output):
+        os.makedirs(output)
+    if not report:
+        report = join(output or os.curdir, 'sanity_report.csv')
+
+    tasks = []
+    for root, _, files in sorted(os.walk(folder_input)):
+        # skip files from a previous output inside the input folder
+        if output and (os.path.realpath(root)+os.sep).startswith(os.path.realpath(output)+os.sep): continue
+        for name in sorted(files):
+            if not name.startswith('Relations - ') or not name.endswith('.txt'): continue
+            if name.endswith('_sanity.txt'): continue
+            file_objects = join(root, 'BBox - '+name[len('Relations - '):])
+            if not isfile(file_objects):
+                file_objects = None
+            fileout = None
+            if output:
+                folder_out = join(output, os.path.relpath(root, folder_input))
+                if not os.path.isdir(folder_out):
+                    os.makedirs(folder_out)
+                fname, ext = splitext(name)
+                fileout = join(folder_out, fname+'_sanity'+ext)
+            tasks.append((file_objects, join(root, name), fileout, config_file, class_file, rels_file))
+    logger.info('Checking {} files of relations...'.format(len(tasks)))
+
+    # compile possible relations once before starting workers
+    ra.possible_relations(config_file, ra.ConfigVocabulary(class_file, rels_file))
+
+    issues = []
+    pool = Pool(nb_workers)
+    for file_issues in pool.imap_unordered(sanitize_pair, tasks):
+        issues.extend(file_issues)
+    pool.close()
+    pool.join()
+
+    issues.sort(key=lambda issue: (issue['file'], issue['line']))
+    for check, nb in sorted(Counter(issue['check'] for issue in issues).items()):
+        logger.info('Found {} issues of {}'.format(nb, check))
+    save_report(issues, report)
+    return issues
 
 
 if __name__ == '__main__':
@@ -124,16 +271,15 @@ if __name__ == '__main__':
     parser.add_argument('input', metavar='file_or_folder', help='File or folder containing decompressed relations annotation')
     parser.add_argument('-b', '--bounding_boxes', help='File containing LIS annotation for objects', default='Bounding_Boxes_Annotation.txt')
     parser.add_argument('-r', '--relations', help='File containing possible relations', default='possible_relations.cfg')
-    parser.add_argument('-o', '--output', help='Path to the file to save the new relations.')
+    parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-l', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-o', '--output', help='Path to the file to save the new relations (folder with --folder).')
     parser.add_argument('-f', '--folder', help='Perform sanitizing of files inside a folder.', action='store_true')
+    parser.add_argument('-p', '--report', help='Path to the JSON or CSV file to save the issues of a folder (default: sanity_report.csv in --output or in the current directory).', default=None)
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
     args = parser.parse_args()
 
     if args.folder:
-        hdobj = fh.FolderHandler(args.input)
-        for objpath in hdobj:
-            fname = basename(objpath)
-            relpath = join(args.input, fname)
-            #sanitize(objpath, relpath, args.output)
-            sanitize_relations(relpath, args.relations)
-    #else:
-    #    sanitize(args.objectfile, args.relationfile, args.output)
+        sanitize_folder(args.input, args.relations, args.report, args.workers, args.class_file, args.relation_file, args.output)
+    else:
+        sanitize_for_bounding_boxes(args.bounding_boxes, args.input, args.output)
@@ -19,16 +19,34 @@ all bounding boxes in the line. When using this option, the user must pass `--tx
 ```
 $ show_box.py file_with_images.txt --txt
 ```
+To check many frames at once, the boxes of all lines of the file can be drawn without opening
+windows and saved as images in a folder (`--output`), optionally grouped in contact sheets
+containing `--sheet` frames each. In this case, the color of each box represents its class:
+
+```
+$ show_box.py file_with_images.txt --txt --output overlays/ --sheet 16
+```
 """
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
+import os
 import argparse
-from PIL import Image
+from os.path import join, basename, isdir
+from multiprocessing import Pool
+from PIL import Image, ImageDraw
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from matplotlib import colors
 import numpy as np
 import ast
 
+import progressbar as pbar
+
+# color of each class id
+COLORS = [colors.cnames[name] for name in colors.cnames]
+
 
 def draw_box(img, boundaries):
     im = np.array(Image.open(img), dtype=np.uint8)
@@ -60,6 +78,168 @@ def draw_from_file(fileinput):
             plt.show()
 
 
+def parse_line(line):
+    """ Return the path of the image, the list of boxes as (xmin, ymin,
+        xmax, ymax, class) and the list of malformed boxes (without 5
+        numbers) of a line. Coordinates may be floats.
+    """
+    arr = line.strip().split()
+    boxes, malformed = [], []
+    for pos in arr[1:]:
+        try:
+            box = tuple(float(v) for v in pos.strip('()').split(','))
+        except ValueError:
+            box = ()
+        if len(box) == 5:
+            boxes.append(box)
+        else:
+            malformed.append(pos)
+    return arr[0], boxes, malformed
+
+
+def overlay(img, boxes, width=2):
+    """ Return the image `img` with `boxes` drawn on it. Inverted boxes
+        (e.g., xmax < xmin) are drawn with their corners swapped.
+    """
+    im = Image.open(img).convert('RGB')
+    draw = ImageDraw.Draw(im)
+    for xmin, ymin, xmax, ymax, class_id in boxes:
+        color = COLORS[int(class_id) % len(COLORS)]
+        xmin, xmax = min(xmin, xmax), max(xmin, xmax)
+        ymin, ymax = min(ymin, ymax), max(ymin, ymax)
+        for k in range(width):
+            draw.rectangle(((xmin-k, ymin-k), (xmax+k, ymax+k)), outline=color)
+    return im
+
+
+def draw_line(nb_line, line, issues):
+    """ Return the path of the image of a line and its overlay (None when
+        the image cannot be opened). Malformed and inverted boxes are added
+        to `issues` as (line, path, message), while the other boxes of the
+        frame are drawn.
+    """
+    img, boxes, malformed = parse_line(line)
+    for pos in malformed:
+        issues.append((nb_line, img, 'malformed box %s' % pos))
+    for xmin, ymin, xmax, ymax, _ in boxes:
+        if xmax < xmin or ymax < ymin:
+            issues.append((nb_line, img, 'inverted box (%g,%g,%g,%g)' % (xmin, ymin, xmax, ymax)))
+    try:
+        return img, overlay(img, boxes)
+    except (IOError, OSError) as err:
+        issues.append((nb_line, img, 'could not open image (%s)' % err))
+        return img, None
+
+
+def save_overlays(task):
+    """ Save the overlay of each line of a batch (executed by workers).
+
+        Output: (number of lines, number of frames not saved, issues)
+            where `issues` contains (line, path, message)
+    """
+    lines, folderout = task
+    nb_errors = 0
+    issues = []
+    for nb_line, line in lines:
+        img, im = draw_line(nb_line, line, issues)
+        if im is None:
+            nb_errors += 1
+            continue
+        im.save(join(folderout, '%06d_%s' % (nb_line, basename(img))))
+    return len(lines), nb_errors, issues
+
+
+def save_sheet(task):
+    """ Save a contact sheet containing the overlays of the lines of a
+        batch in a grid (executed by workers). Frames that cannot be
+        opened are left blank in the sheet.
+
+        Output: (number of lines, number of frames not drawn, issues)
+            where `issues` contains (line, path, message)
+    """
+    nb_sheet, lines, folderout, thumb = task
+    cols = int(np.ceil(np.sqrt(len(lines))))
+    rows = int(np.ceil(len(lines)/float(cols)))
+    thumbs = []
+    nb_errors = 0
+    issues = []
+    for nb_line, line in lines:
+        img, im = draw_line(nb_line, line, issues)
+        if im is None:
+            nb_errors += 1
+            im = Image.new('RGB', (thumb, thumb))
+        im.thumbnail((thumb, thumb))
+        ImageDraw.Draw(im).text((2, 2), '%d: %s' % (nb_line, basename(img)), fill='white')
+        thumbs.append(im)
+    sheet = Image.new('RGB', (cols*thumb, rows*thumb))
+    for i, im in enumerate(thumbs):
+        sheet.paste(im, ((i % cols)*thumb, (i // cols)*thumb))
+    sheet.save(join(folderout, 'sheet_%06d.jpg' % nb_sheet))
+    return len(lines), nb_errors, issues
+
+
+def iterate_batches(fileinput, batch_size):
+    """ Group the (number, content) of non-empty lines of `fileinput` in
+        lists containing `batch_size` lines
+    """
+    batch = []
+    with open(fileinput) as fin:
+        for nb_line, line in enumerate(fin, start=1):
+            if not line.strip(): continue
+            batch.append((nb_line, line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def draw_batch(fileinput, folderout, sheet=None, thumb=256, nb_workers=None, batch_size=100):
+    """ Draw the boxes of all lines of `fileinput` without opening windows.
+
+        Parameters:
+        -----------
+        fileinput: string
+            file containing the path to the image and boxes in each line
+        folderout: string
+            folder where images are saved
+        sheet: int (optional)
+            number of frames of each contact sheet. Each frame is saved
+            as an image when `sheet` is not informed.
+        thumb: int
+            maximum size of frames in contact sheets
+        nb_workers: int (optional)
+            number of processes (default: number of CPUs)
+        batch_size: int
+            number of frames sent to each worker at once
+    """
+    if not isdir(folderout):
+        os.makedirs(folderout)
+    with open(fileinput) as fin:
+        nb_lines = sum(1 for line in fin if line.strip())
+    pb = pbar.ProgressBar(nb_lines)
+    pool = Pool(nb_workers)
+    if sheet:
+        tasks = ((i, lines, folderout, thumb) for i, lines in enumerate(iterate_batches(fileinput, sheet)))
+        results = pool.imap_unordered(save_sheet, tasks)
+    else:
+        tasks = ((lines, folderout) for lines in iterate_batches(fileinput, batch_size))
+        results = pool.imap_unordered(save_overlays, tasks)
+    nb_errors = 0
+    issues = []
+    for nb_frames, errors, batch_issues in results:
+        nb_errors += errors
+        issues.extend(batch_issues)
+        pb.update(nb_frames)
+    pool.close()
+    pool.join()
+    for nb_line, img, message in sorted(issues):
+        logger.warning('Line %d (%s): %s' % (nb_line, img, message))
+    logger.info('Saved overlays of %d frames at: %s' % (nb_lines-nb_errors, folderout))
+    if nb_errors:
+        logger.warning('Could not open %d images' % nb_errors)
+
+
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
     argparser.add_argument('imgfile', metavar='image', help='Path to the image')
@@ -68,9 +248,15 @@ if __name__ == "__main__":
     argparser.add_argument('-y', '--ymin_value', help='Pixel top left of the box in Y', type=int, default=0)
     argparser.add_argument('-X', '--xmax_value', help='Pixel bottom right of the box in X', type=int, default=0)
     argparser.add_argument('-Y', '--ymax_value', help='Pixel bottom right of the box in Y', type=int, default=0)
+    argparser.add_argument('-o', '--output', help='Folder to save images with boxes instead of showing them (requires --txt)', default=None)
+    argparser.add_argument('-s', '--sheet', help='Number of frames in each contact sheet (requires --output)', type=int, default=None)
+    argparser.add_argument('-m', '--thumb', help='Maximum size of frames in contact sheets', type=int, default=256)
+    argparser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
     args = argparser.parse_args()
 
-    if args.txt:
+    if args.txt and args.output:
+        draw_batch(args.imgfile, args.output, args.sheet, args.thumb, args.workers)
+    elif args.txt:
         draw_from_file(args.imgfile)
     else:
         draw_box(args.imgfile, [args.xmin_value, args.ymin_value, args.xmax_value, args.ymax_value])
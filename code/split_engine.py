@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Split engine working on unique integer ids (e.g., frames). Ids are
+grouped in units that are never separated (e.g., all frames of a
+recording), units are shuffled with a fixed seed and, when strata are
+informed (e.g., recipe or rarest object class of each frame), units are
+interleaved so that every prefix of the shuffled units keeps the
+proportion of each stratum. Thus, for ids:
+
+ids    = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+strata = [0, 0, 0, 0, 0, 1, 1, 1, 1, 1]
+
+`split_ids(ids, [0.8, 0.2], strata=strata)` returns a train set with 4
+ids of each stratum and a test set with 1 id of each stratum, while
+`sample_ids(ids, [0.2, 0.6])` returns nested samples (without
+replacement) with 2 and 6 ids.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import numpy as np
+
+
+def make_rng(seed=None):
+    """ Return a NumPy random generator (RandomState for old versions) """
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+
+def uniform(rng, size):
+    """ Return `size` random floats in [0, 1) from `rng` """
+    if hasattr(rng, 'random_sample'):
+        return rng.random_sample(size)
+    return rng.random(size)
+
+
+def encode(labels):
+    """ Convert a list of labels (e.g., strings) into integer ids """
+    _, ids = np.unique(np.asarray(labels), return_inverse=True)
+    return ids.ravel()
+
+
+def combine(*labels):
+    """ Combine several lists of labels into a single array of strata """
+    codes = [encode(lab) for lab in labels]
+    dims = [int(code.max())+1 if len(code) else 1 for code in codes]
+    return np.ravel_multi_index(codes, dims)
+
+
+def rarest_class(frames, classes):
+    """ Return the unique frames and the least frequent class (over all
+        boxes) of each frame. Ties are broken by the smallest class id.
+
+        Parameters:
+        -----------
+        frames: array
+            id of the frame of each box
+        classes: array
+            id of the class of each box
+    """
+    frames = np.asarray(frames)
+    classes = np.asarray(classes)
+    freq = np.bincount(classes)
+    order = np.lexsort((classes, freq[classes], frames))
+    uframes, first = np.unique(frames[order], return_index=True)
+    return uframes, classes[order][first]
+
+
+def shuffle_key(rng, nb_units, strata=None):
+    """ Return a random key for each unit so that sorting units by their
+        keys shuffles them. With `strata`, the key is the random position
+        of the unit inside its stratum divided by the size of the stratum,
+        which interleaves strata.
+    """
+    key = uniform(rng, nb_units)
+    if strata is None:
+        return key
+    inv = encode(strata)
+    counts = np.bincount(inv)
+    order = np.lexsort((key, inv))
+    starts = np.cumsum(counts)-counts
+    rank = np.empty(nb_units)
+    rank[order] = np.arange(nb_units)-np.repeat(starts, counts)
+    return (rank+uniform(rng, nb_units))/counts[inv]
+
+
+def units(ids, groups=None, strata=None):
+    """ Remove duplicates of `ids` and assign ids to units.
+
+        Parameters:
+        -----------
+        ids: array
+            integer ids (duplicates are removed)
+        groups: array (optional)
+            group of each id. Ids of the same group share the same unit.
+        strata: array (optional)
+            stratum of each id. Units take the stratum of their first id.
+
+        Output: (ids, unit of each id, number of ids of each unit,
+            stratum of each unit or None)
+    """
+    ids, first = np.unique(np.asarray(ids), return_index=True)
+    if groups is None:
+        unit = np.arange(len(ids))
+    else:
+        unit = encode(np.asarray(groups)[first])
+    weights = np.bincount(unit)
+    ustrata = None
+    if strata is not None:
+        _, ufirst = np.unique(unit, return_index=True)
+        ustrata = np.asarray(strata)[first][ufirst]
+    return ids, unit, weights, ustrata
+
+
+def unit_positions(rng, weights, ustrata=None):
+    """ Shuffle units and return their positions in [0, 1], i.e., the
+        relative position of the middle of each unit after shuffling.
+        Units are weighted by their number of ids.
+    """
+    if not len(weights):
+        return np.zeros(0)
+    order = np.argsort(shuffle_key(rng, len(weights), ustrata), kind='mergesort')
+    cum = np.cumsum(weights[order])
+    mid = np.empty(len(weights))
+    mid[order] = (cum-weights[order]/2.0)/cum[-1]
+    return mid
+
+
+def positions(ids, groups=None, strata=None, seed=None):
+    """ Shuffle the unique `ids` and return them with their positions in
+        [0, 1] (see `units` and `unit_positions`).
+    """
+    ids, unit, weights, ustrata = units(ids, groups, strata)
+    return ids, unit_positions(make_rng(seed), weights, ustrata)[unit]
+
+
+def split_ids(ids, sizes, groups=None, strata=None, seed=None):
+    """ Split `ids` into disjoint sets containing `sizes` fractions of ids
+        (e.g., [0.8, 0.2]). Ids not covered by `sizes` (when they sum less
+        than 1) are discarded. See `positions` for the other parameters.
+
+        Output: list of sorted arrays of ids, one for each size
+    """
+    ids, pos = positions(ids, groups, strata, seed)
+    part = np.searchsorted(np.cumsum(sizes), pos, side='right')
+    return [ids[part == i] for i in range(len(sizes))]
+
+
+def sample_ids(ids, fractions, groups=None, strata=None, seed=None):
+    """ Sample `fractions` of `ids` without replacement (e.g., [0.1, 0.3]).
+        Samples of the same call are nested, i.e., the sample with 10% of
+        ids is contained in the sample with 30%. See `positions` for the
+        other parameters.
+
+        Output: list of sorted arrays of ids, one for each fraction
+    """
+    ids, pos = positions(ids, groups, strata, seed)
+    return [ids[pos < frac] for frac in fractions]
+
+
+def sample_masks(ids, fractions, seeds, groups=None, strata=None):
+    """ Sample `fractions` of `ids` for each seed of `seeds` as in
+        `sample_ids`, i.e., the sample of a seed is the same returned by
+        `sample_ids` with that seed. Units are computed once and samples
+        of all seeds and fractions are selected at once.
+
+        Output: (ids, masks) where `masks[i, j]` is the boolean mask of
+            `ids` sampled with `seeds[i]` and `fractions[j]`
+    """
+    ids, unit, weights, ustrata = units(ids, groups, strata)
+    pos = np.array([unit_positions(make_rng(seed), weights, ustrata) for seed in seeds])
+    pos = pos.reshape(len(seeds), len(weights))[:, unit]
+    masks = pos[:, np.newaxis, :] < np.asarray(fractions)[np.newaxis, :, np.newaxis]
+    return ids, masks
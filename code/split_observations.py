@@ -7,6 +7,14 @@ file containing 100 frames, this script creates a folder `10/` containing
 a file with the same name of the input file, but containing only 10% of 
 the total of frames. Thus, the file contains 10 frames. The same is valid
 for `20/`, `30/`, `50/` and `70/`. The last containing 70% of the frames.
+Frames are sampled without replacement and splits are nested, i.e., frames
+of `10/` are also in `30/`.
+
+With `--nb_seeds N`, each file is loaded once and sampled with N seeds
+(`seed`, `seed+1`, ...), creating the folders `<seed>/10/`, `<seed>/30/`,
+etc., or a single compressed bundle (`--bundle`) containing the relations
+of each file and the sampled frames of each seed and split (see
+`load_bundle`).
  
 """
 import logging
@@ -16,14 +24,26 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import sys
 import os
 import argparse
-from os.path import join, dirname, isdir
-import random
+from os.path import join, dirname, isdir, realpath, relpath
+from multiprocessing import Pool
+
+import numpy as np
 
 import filehandler as fh
+import relation_arrays as ra
+import split_engine as se
 
 SPLITS = [10, 30, 50, 70]
 
-def save_file(fileoutput, sampling, idx2rels):
+def triplet_lines(rarr):
+    """ Return the end of the line (after the id of the frame) of each
+        triplet id of `rarr`
+    """
+    decode = rarr.vocab.decode
+    return ['\t{}\t{}\t{}\n'.format(*decode(idt)) for idt in range(len(rarr.vocab))]
+
+
+def save_file(fileoutput, sampling, rarr, ends):
     """ Save the selected sampling frames in the output file. 
 
         Parameters:
@@ -31,23 +51,32 @@ def save_file(fileoutput, sampling, idx2rels):
         fileoutput: string
             path where the content is saved
         sampling: array
-            list containing the selected indexes to be saved
-        idx2rels: dict
-            dictionary containing the id of the frame as key and
-            the relationship as value
+            sorted indexes of the frames of `rarr` to be saved
+        rarr: RelationArrays
+            relations of the input file
+        ends: list
+            end of the lines of each triplet id (see `triplet_lines`)
     """ 
     logger.info('Saving splitted observations at: {}'.format(fileoutput)) 
-    with open(fileoutput, 'w') as fout:
-        fout.write('Frame\tSubject\tRelation\tObject\n')
-        id = 0
-        for idfr in sorted(sampling):
-            for s, r, o in idx2rels[idfr]:
-                fout.write('{}\t{}\t{}\t{}\n'.format(id, s, r, o))
-            id += 1
+    offsets = rarr.offsets.tolist()
+    triplets = rarr.triplets.tolist()
+    lines = ['Frame\tSubject\tRelation\tObject\n']
+    for id, i in enumerate(sampling.tolist()):
+        start, end = offsets[i], offsets[i+1]
+        prefix = str(id)
+        if start == end:
+            lines.append(prefix+'\tNone\tNone\tNone\n')
+        else:
+            lines.extend([prefix+ends[idt] for idt in triplets[start:end]])
+    ftmp = fileoutput+'.part'
+    with open(ftmp, 'w') as fout:
+        fout.writelines(lines)
+    os.rename(ftmp, fileoutput)
  
 
-def split_file(path, folders):
-    """ Create the set of splits for a single file.
+def split_file(path, folders, seed=None, name=None):
+    """ Create the set of splits for a single file. The file is loaded
+        once as integer arrays and all splits are sampled at once.
         
         Parameters:
         -----------
@@ -57,25 +86,157 @@ def split_file(path, folders):
             dictionary containing the id of the split as key
             and the path to the folder where the split is 
             saved as value.
+        seed: int (optional)
+            seed of the random generator
+        name: string (optional)
+            path of the output file relative to the folder of each split
+            (default: the name of the input file)
     """
-    filerels = fh.DecompressedFile(path)
-    idx2rels = {}
-    with filerels as frels:
-        fname_in = frels.filename
-        for idfr, arr in frels.iterate_frames():
-            idx2rels[idfr] = arr
+    rarr = ra.load_decompressed(path)
+    fname_in = name or fh.DecompressedFile(path).filename
+    ends = triplet_lines(rarr)
+    nb_frames = rarr.nb_frames()
     
-    for split in sorted(folders):
-        perc = int(len(idx2rels)*split/100)
-        logger.info('Creating split with {}%: {}*0.{} = {} observations'.format(split, len(idx2rels), split, perc))
-        indexes = list(idx2rels.keys())
-        sampling = random.choices(indexes, k=perc)
-
+    splits = sorted(folders)
+    samplings = se.sample_ids(rarr.idframes, [split/100. for split in splits], seed=seed)
+    for split, sampling in zip(splits, samplings):
+        logger.info('Creating split with {}%: {}*0.{} = {} observations'.format(split, nb_frames, split, len(sampling)))
         fileoutput = join(folders[split], fname_in)
-        save_file(fileoutput, sampling, idx2rels)
+        save_file(fileoutput, np.searchsorted(rarr.idframes, sampling), rarr, ends)
+    return path
+
 
+def split_seeds(path, splits, seeds, folders=None, bundle=False, name=None):
+    """ Create the splits of a single file for several seeds. The file is
+        loaded once and samples of all seeds are selected at once (see
+        `split_engine.sample_masks`).
 
-def split_from_folder(folder_input, output=None):
+        Parameters:
+        -----------
+        path: string
+            path to the input Decompressed file
+        splits: list
+            percentages of the splits
+        seeds: list
+            seeds of the random generator
+        folders: dict (optional)
+            dictionary containing the seed as key and the dictionary of
+            folders of each split (as in `split_file`) as value. Files are
+            not saved when `folders` is not informed.
+        bundle: boolean
+            return the arrays of the file to be saved in a bundle
+        name: string (optional)
+            path of the output file relative to the folder of each split
+            (default: the name of the input file)
+
+        Output: (path, arrays) where `arrays` is None when `bundle` is False
+    """
+    rarr = ra.load_decompressed(path)
+    fname_in = name or fh.DecompressedFile(path).filename
+    ids, masks = se.sample_masks(rarr.idframes, [split/100. for split in splits], seeds)
+    indexes = np.searchsorted(rarr.idframes, ids)
+    if folders:
+        ends = triplet_lines(rarr)
+        for i, seed in enumerate(seeds):
+            for j, split in enumerate(splits):
+                fileoutput = join(folders[seed][split], fname_in)
+                save_file(fileoutput, indexes[masks[i, j]], rarr, ends)
+    arrays = None
+    if bundle:
+        vocab = [rarr.vocab.decode(idt) for idt in range(len(rarr.vocab))]
+        # masks of all frames of the file (frames are unique in Decompressed files)
+        frame_masks = np.zeros(masks.shape[:2]+(rarr.nb_frames(),), dtype=bool)
+        frame_masks[:, :, indexes] = masks
+        arrays = {
+            'idframes': rarr.idframes,
+            'offsets': rarr.offsets,
+            'triplets': rarr.triplets.astype(np.int32),
+            'vocab': np.array(vocab, dtype=str).reshape(-1, 3),
+            'masks': np.packbits(frame_masks, axis=-1),
+        }
+    return path, arrays
+
+
+def split_task(task):
+    """ Create the splits of a file (executed by workers). Errors (including
+        `sys.exit` of malformed lines) are returned instead of raised, thus,
+        a bad file does not stop the pool.
+
+        Output: (path, arrays, error) where `error` is None for files that
+            were split
+    """
+    path, name, folders, seed, seeds, bundle = task
+    try:
+        if seeds is None:
+            return split_file(path, folders, seed, name), None, None
+        return split_seeds(path, SPLITS, seeds, folders, bundle, name)+(None,)
+    except (Exception, SystemExit) as err:
+        return path, None, repr(err)
+
+
+def save_bundle(fbundle, seeds, splits, files):
+    """ Save the arrays of each file (see `split_seeds`) in a single
+        compressed file. Arrays of the i-th file are saved as `<name>_<i>`.
+
+        Parameters:
+        -----------
+        fbundle: string
+            path to the `.npz` file
+        seeds: list
+            seeds of the random generator
+        splits: list
+            percentages of the splits
+        files: list
+            list of (name, arrays) of each file, where `name` is the path
+            of the file relative to the input folder. Names must be unique.
+    """
+    fnames = [fname for fname, _ in files]
+    if len(set(fnames)) != len(fnames):
+        duplicated = sorted(set(fname for fname in fnames if fnames.count(fname) > 1))
+        raise ValueError('Duplicated files in bundle: {}'.format(', '.join(duplicated)))
+    data = {
+        'seeds': np.array(seeds, dtype=np.int64),
+        'splits': np.array(splits, dtype=np.int64),
+        'files': np.array(fnames, dtype=str),
+    }
+    for i, (_, arrays) in enumerate(files):
+        for name, arr in arrays.items():
+            data['{}_{}'.format(name, i)] = arr
+    np.savez_compressed(fbundle, **data)
+    logger.info('Saved bundle of {} files and {} seeds at: {}'.format(len(files), len(seeds), fbundle))
+
+
+def load_bundle(fbundle):
+    """ Load a bundle created by `save_bundle`.
+
+        Output: (seeds, splits, files) where `files` is a dictionary
+            containing the path of the file relative to the input folder
+            (e.g. `data1/Relations - omelette.txt`) as key and (rarr, masks) as
+            value. `rarr` is a `RelationArrays` and `masks[i, j]` is the
+            boolean mask of the frames of `rarr` sampled with `seeds[i]`
+            and `splits[j]`, e.g., `rarr.idframes[masks[i, j]]`.
+    """
+    data = np.load(fbundle)
+    seeds = data['seeds'].tolist()
+    splits = data['splits'].tolist()
+    files = {}
+    for i, fname in enumerate(data['files'].tolist()):
+        if fname in files:
+            raise ValueError('Duplicated file in bundle {}: {}'.format(fbundle, fname))
+        vocab = ra.Vocabulary()
+        for sub, rel, obj in data['vocab_{}'.format(i)].tolist():
+            vocab.encode(sub, rel, obj)
+        idframes = data['idframes_{}'.format(i)]
+        offsets = data['offsets_{}'.format(i)]
+        triplets = data['triplets_{}'.format(i)].astype(np.int64)
+        frames = np.repeat(idframes, np.diff(offsets))
+        rarr = ra.RelationArrays(frames, triplets, idframes, offsets, vocab)
+        masks = np.unpackbits(data['masks_{}'.format(i)], axis=-1)[:, :, :len(idframes)].astype(bool)
+        files[fname] = (rarr, masks)
+    return seeds, splits, files
+
+
+def split_from_folder(folder_input, output=None, seed=None, nb_workers=None, nb_seeds=None, bundle=None):
     """ Read a folder containing Decompressed files and 
         create a split dataset for each file.
 
@@ -86,29 +247,93 @@ def split_from_folder(folder_input, output=None):
         output: string (optional)
             path to the folder where the files containing splits
             are saved.
+        seed: int (optional)
+            seed of the random generator
+        nb_workers: int (optional)
+            number of processes (default: number of CPUs)
+        nb_seeds: int (optional)
+            number of samples of each split using seeds from `seed` (or 0)
+            to `seed+nb_seeds-1`
+        bundle: string (optional)
+            path to the `.npz` file where samples of all seeds are saved
+            instead of creating folders (requires `nb_seeds`)
+
+        Files keep their subfolders inside `folder_input` in the folder of
+        each split (e.g. `data1/file.txt` is saved as `10/data1/file.txt`).
     """
+    default_output = join(folder_input, 'splits')
     if not output:
         output = join(folder_input, 'splits.tmp')
-        output = fh.mkdir_from_file(output)
+        if not bundle:
+            output = fh.mkdir_from_file(output)
     
+    seeds = None
+    if nb_seeds:
+        seeds = list(range(seed or 0, (seed or 0)+nb_seeds))
+
     # create folders
     folders = {}
-    for split in SPLITS:
-        folder_out = join(output, str(split))
-        folder_out = fh.mkdir_from_file(folder_out)
-        folders[split] = folder_out
+    if seeds is None:
+        for split in SPLITS:
+            folder_out = join(output, str(split))
+            folder_out = fh.mkdir_from_file(folder_out)
+            folders[split] = folder_out
+    elif not bundle:
+        for sd in seeds:
+            folders[sd] = {}
+            for split in SPLITS:
+                folder_out = join(output, str(sd), str(split))
+                folder_out = fh.mkdir_from_file(folder_out)
+                folders[sd][split] = folder_out
+
+    # skip files from the output (or from a previous default output) inside the input folder
+    skip = [realpath(folder)+os.sep for folder in (output, default_output)]
+    files = [path for path in fh.FolderHandler(folder_input)
+             if not any(realpath(path).startswith(folder) for folder in skip)]
+    names = dict((path, relpath(path, folder_input)) for path in files)
+
+    # create the subfolders of the input inside the folder of each split
+    subfolders = set(dirname(name) for name in names.values()) - set([''])
+    split_folders = folders.values() if seeds is None else [f for fsd in folders.values() for f in fsd.values()]
+    for folder in split_folders:
+        for subfolder in subfolders:
+            if not isdir(join(folder, subfolder)):
+                os.makedirs(join(folder, subfolder))
 
-    files = fh.FolderHandler(folder_input)
-    for path in files:
-        logger.info('Processing file: %s' % path)
-        split_file(path, folders)
-    logger.info('Finished successfully!')
+    pool = Pool(nb_workers)
+    tasks = [(path, names[path], folders, seed, seeds, bool(bundle)) for path in files]
+    arrays = {}
+    errors = []
+    for path, arr, error in pool.imap_unordered(split_task, tasks):
+        if error:
+            logger.error('Could not split file: %s (%s)' % (path, error))
+            errors.append(path)
+            continue
+        logger.info('Processed file: %s' % path)
+        arrays[path] = arr
+    pool.close()
+    pool.join()
+    if bundle:
+        save_bundle(bundle, seeds, SPLITS, [(names[path], arrays[path]) for path in files if path in arrays])
+    if errors:
+        logger.error('Failed to split %d files:' % len(errors))
+        for path in sorted(errors):
+            logger.error('- %s' % path)
+    else:
+        logger.info('Finished successfully!')
+    return errors
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', metavar='input_folder', help='Plain text file')
     parser.add_argument('-o', '--output', help='Plain text file', default=None)
+    parser.add_argument('-s', '--seed', help='Seed of the random generator', type=int, default=None)
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
+    parser.add_argument('-n', '--nb_seeds', help='Number of samples (seeds) of each split', type=int, default=None)
+    parser.add_argument('-b', '--bundle', help='Save samples of all seeds in a single .npz file (requires --nb_seeds)', default=None)
     args = parser.parse_args()
+    if args.bundle and not args.nb_seeds:
+        parser.error('--bundle requires --nb_seeds')
     
-    split_from_folder(args.input, args.output)
+    split_from_folder(args.input, args.output, args.seed, args.workers, args.nb_seeds, args.bundle)
@@ -31,7 +31,8 @@ KSCGR/
   - ...
 -...
 
-We use a mapping file (`map_paths.txt`) to convert from one type to the other. 
+We use a mapping file (`map_paths.txt`) to convert from one type to the other, which
+is queried through its mapping store (`map_paths.db`, see `mapstore.py`).
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -43,36 +44,50 @@ import argparse
 from os.path import splitext, basename, isdir, join, dirname
 
 import filehandler as fh
+import mapstore
 import progressbar as pbar
 
-def main(vocfile, mapfile, output=None):
+
+def save_batch(fout, batch, store):
+    """ Translate the VOC paths of a batch of lines at once and save them """
+    paths = store.kscgr_paths([arr[-1] for _, arr in batch])
+    for (nb_line, arr), path in zip(batch, paths):
+        if path is None:
+            logger.warning('Could not map file! Key do not exist. {} [LINE: {}]'.format(arr[-1], nb_line))
+        else:
+            idfr, _ = splitext(basename(path))
+            fout.write('{}\t{}\t{}\t{}\t{}\n'.format(idfr, arr[1], arr[2], arr[3], path))
+
+
+def main(vocfile, mapfile, output=None, batch_size=100000):
     """ Convert VOC paths to KSCGR paths """
     if not output:
         fname, _ = splitext(basename(vocfile))
         output = join(dirname(vocfile), fname+'_kscgr.txt')
 
     # load mapping
-    dmap = fh.MapFile(mapfile).load_dictionary(key='voc')
-    logger.info('Loaded mapping for {} paths'.format(len(dmap)))          
+    store = mapstore.load_store(mapfile)
+    logger.info('Loaded mapping for {} paths'.format(len(store)))
 
     flis = fh.LisFile(vocfile)
     pb = pbar.ProgressBar(flis.nb_lines())
     with flis as fin, open(output, 'w') as fout:
+        batch = []
         for arr in fin:
-            if not dmap.has_key(arr[-1]):
-                logger.warning('Could not map file! Key do not exist. {} [LINE: {}]'.format(arr[-1], flis.nb_line)) #test flis.fname
-            else:
-                path = dmap[arr[-1]]
-                idfr, _ = splitext(basename(path))
-                fout.write('{}\t{}\t{}\t{}\t{}\n'.format(idfr, arr[1], arr[2], arr[3], path))
+            batch.append((flis.nb_line, arr))
+            if len(batch) == batch_size:
+                save_batch(fout, batch, store)
+                batch = []
             pb.update()
+        save_batch(fout, batch, store)
+    store.close()
     logger.info('File saved at: {}'.format(output))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('inputfile', metavar='input', help='Path to the file containing paths of the VOC dataset.')
-    parser.add_argument('mapfile', metavar='map_paths', help='Path to the file containing the mapping between annotations.')
+    parser.add_argument('mapfile', metavar='map_paths', help='Path to the file containing the mapping between annotations (map_paths.txt or map_paths.db).')
     parser.add_argument('-o', '--output', help='Plain text file', default=None)
     args = parser.parse_args()
     main(args.inputfile, args.mapfile, args.output)
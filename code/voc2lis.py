@@ -39,16 +39,80 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
 import os
+import re
 import argparse
 from os.path import join, isdir, splitext, basename, dirname
-from lxml import etree as ET
-from PIL import Image
+from multiprocessing import Pool
+from xml.sax.saxutils import unescape
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 import progressbar as pbar
 import filehandler as fh
 
 
-def main(inputfolder, fileoutput):
+# blocks of the fixed VOC schema
+RE_PATH = re.compile(r'<path>([^<]*)</path>')
+RE_FILENAME = re.compile(r'<filename>([^<]*)</filename>')
+RE_OBJECT = re.compile(r'<object>\s*<name>([^<]*)</name>.*?<bndbox>\s*'
+                       r'<xmin>\s*(-?\d+)\s*</xmin>\s*<ymin>\s*(-?\d+)\s*</ymin>\s*'
+                       r'<xmax>\s*(-?\d+)\s*</xmax>\s*<ymax>\s*(-?\d+)\s*</ymax>', re.S)
+# entities not replaced by default by `unescape` (besides &amp;, &lt; and &gt;)
+ENTITIES = {'&quot;': '"', '&apos;': "'"}
+
+
+def iterparse_xml(xml_file):
+    """ Extract the path of the image and the objects of a VOC file
+        using `iterparse`, clearing each object after it is read. Float
+        coordinates are truncated to integers.
+
+        Output: (path, [(name, xmin, ymin, width, height), ...])
+    """
+    path = filename = None
+    objs = []
+    for _, elem in ET.iterparse(xml_file):
+        if elem.tag == 'path':
+            path = elem.text
+        elif elem.tag == 'filename':
+            filename = elem.text
+        elif elem.tag == 'object':
+            box = elem.find('bndbox')
+            xmin, ymin, xmax, ymax = [int(float(box.findtext(pos))) for pos in ('xmin', 'ymin', 'xmax', 'ymax')]
+            objs.append((elem.findtext('name'), xmin, ymin, xmax-xmin, ymax-ymin))
+            elem.clear()
+    if path is None:
+        path = filename
+    return path, objs
+
+
+def parse_xml(xml_file):
+    """ Extract the path of the image and the objects of a VOC file
+        (executed by workers). Files following the fixed VOC schema are
+        read with regular expressions, while other files (e.g., containing
+        comments, character references, attributes or float coordinates)
+        are read by `iterparse_xml`.
+
+        Output: (path, [(name, xmin, ymin, width, height), ...])
+    """
+    with open(xml_file) as fin:
+        text = fin.read()
+    boxes = RE_OBJECT.findall(text)
+    # each object must be matched by exactly one box
+    if '<!' in text or '&#' in text or \
+       text.count('<object') != len(boxes) or text.count('<bndbox') != len(boxes):
+        return iterparse_xml(xml_file)
+    objs = []
+    for name, xmin, ymin, xmax, ymax in boxes:
+        xmin, ymin, xmax, ymax = int(xmin), int(ymin), int(xmax), int(ymax)
+        objs.append((unescape(name, ENTITIES), xmin, ymin, xmax-xmin, ymax-ymin))
+    match = RE_PATH.search(text) or RE_FILENAME.search(text)
+    path = unescape(match.group(1), ENTITIES) if match else None
+    return path, objs
+
+
+def main(inputfolder, fileoutput, nb_workers=None):
     if not fileoutput:
         fileoutput = join(inputfolder, '../lis_annotation.txt')
     fileclasses = join(dirname(fileoutput), 'classes.txt')
@@ -58,23 +122,25 @@ def main(inputfolder, fileoutput):
     nb_files = fhandler.nb_files()
     pb = pbar.ProgressBar(nb_files)
     logger.info('Processing %d files!' % nb_files)
+    ids = sorted(fhandler.dfiles)
+    files = [fhandler.dfiles[id] for id in ids]
+    pool = Pool(nb_workers)
     with open(fileoutput, 'w') as fout:
         ##0 \t object \t (52,104,52,43) \t 0 \t data1/boild-egg/0.jpg
         fout.write('Frame:\tLabel:\tPoints:\tBounding Box ID:\tFrame path\n')
-        for fname in fhandler:
-            id = fhandler.id
-            fvoc = fh.VOCXML(fname)
-            path = fvoc.image_path()
-            objs = fvoc.extract_objects()
-            for obj in objs:
-                name, dpos = obj
-                if not dclasses.has_key(name):
+        # files are parsed by workers and written in the order of ids
+        results = pool.imap(parse_xml, files, chunksize=100)
+        for id, (path, objs) in zip(ids, results):
+            lines = []
+            for name, x, y, w, h in objs:
+                if name not in dclasses:
                     dclasses[name] = len(dclasses)
-                w = dpos['xmax'] - dpos['xmin']
-                h = dpos['ymax'] - dpos['ymin']
-                fout.write('%d\t%s\t(%d,%d,%d,%d)\t%d\t%s\n' % (id, name, dpos['xmin'], dpos['ymin'], w, h, dclasses[name], path))
+                lines.append('%d\t%s\t(%d,%d,%d,%d)\t%d\t%s\n' % (id, name, x, y, w, h, dclasses[name], path))
+            fout.writelines(lines)
             pb.update()
         fout.write('---\nModified on:\t11.11.2011\t11:11')
+    pool.close()
+    pool.join()
     logger.info('Saved output file at: %s' % fileoutput)
     with open(fileclasses, 'w') as fout:
         for cl in dclasses:
@@ -85,5 +151,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('inputfolder', metavar='folder_input', help='Folder containing XML files with VOC annotation')
     parser.add_argument('output', metavar='file_output', help='File to save the LIS annotation')
+    parser.add_argument('-w', '--workers', help='Number of processes (default: number of CPUs)', type=int, default=None)
     args = parser.parse_args()
-    main(args.inputfolder, args.output)
+    main(args.inputfolder, args.output, args.workers)